@@ -0,0 +1,309 @@
+"""Compact per-user scheduler state for very large user counts.
+
+Instead of nested dicts keyed by ``"Monday"`` and ``"07:30"``, each user
+is a row in a set of typed arrays:
+
+* the weekly schedule is seven bit-packed slot masks (bit ``i`` is
+  ``TIME_SLOTS[i]``, bit 0 being 07:00),
+* playlist URIs are interned to ints; a user's rotation is a slice of
+  URI ids in one shared array. Slices come in power-of-two capacities
+  and are recycled through per-capacity free lists, so edits and
+  removals reuse space instead of appending,
+* the rotation index and per-playlist elapsed milliseconds are columns in
+  array-backed position tables, the latter aligned with the rotation slice.
+
+Date overrides, blocked dates and track positions are rare, so they live
+in a ``__slots__`` record per row only for users that have them, with
+dates as ordinals and slots as masks.
+
+Times passed in and returned are naive times on the caller's local
+clock. A row may name its own time zone (interned, two bytes per row);
+its slots are then matched against the wall time in that zone.
+"""
+import sys
+from array import array
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from schedule import DAYS, TIME_SLOTS
+
+SLOTS_PER_DAY = len(TIME_SLOTS)
+FULL_DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+SLOT_BITS = {slot: 1 << i for i, slot in enumerate(TIME_SLOTS)}
+FIRST_SLOT = time(7, 0)
+SLOT_SECONDS = 30 * 60
+MAX_ROTATION = 255
+
+
+def slice_capacity(length):
+    """Rotation slice size for ``length`` playlists: the next power of two, capped at MAX_ROTATION"""
+    return min(1 << (length - 1).bit_length(), MAX_ROTATION) if length else 0
+
+
+def day_mask(day_schedule):
+    """Bit-pack a {'wholeDay', 'timeSlots'} day schedule"""
+    if not day_schedule:
+        return 0
+    if day_schedule.get('wholeDay'):
+        return FULL_DAY_MASK
+    mask = 0
+    for slot, enabled in (day_schedule.get('timeSlots') or {}).items():
+        if enabled:
+            mask |= SLOT_BITS.get(slot, 0)
+    return mask
+
+
+def to_local(at, tz):
+    """A naive time on this machine's clock as naive wall time in ``tz``"""
+    return at.astimezone(tz).replace(tzinfo=None)
+
+
+def from_local(local, tz):
+    """Naive wall time in ``tz`` as a naive time on this machine's clock"""
+    return local.replace(tzinfo=tz).astimezone().replace(tzinfo=None)
+
+
+def parse_date_key(date_key):
+    year, month, day = date_key.split('-')
+    return datetime(int(year), int(month), int(day)).toordinal()
+
+
+class InternTable:
+    """Maps values to small ints and back; each distinct value is stored once"""
+
+    __slots__ = ('ids', 'values')
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def intern(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def __getitem__(self, value_id):
+        return self.values[value_id]
+
+
+class UserExtras:
+    """Sparse per-user state; only allocated when a user has any of it"""
+
+    __slots__ = ('overrides', 'blocked', 'track_positions')
+
+    def __init__(self, overrides, blocked, track_positions):
+        self.overrides = overrides  # date ordinal -> slot mask
+        self.blocked = blocked  # frozenset of date ordinals
+        self.track_positions = track_positions  # uri id -> position ms
+
+
+class CompactStore:
+    """Columnar scheduler state for many users, addressed by row"""
+
+    def __init__(self):
+        self.rows = {}  # user_id -> row
+        self.user_ids = []  # row -> user_id, None for a free row
+        self.free_rows = []
+        self.week_masks = array('I')  # 7 per row, Monday first
+        self.play_duration = array('H')  # seconds
+        self.rotation_index = array('I')  # currentPlaylistIndex
+        self.timezone_ids = array('H')  # row -> id in ``timezones``, 0 for the local clock
+        self.rotation_offsets = array('I')  # row -> start of its slice of the two arrays below
+        self.rotation_lengths = array('B')
+        self.rotation_capacity = array('B')  # row -> size of its slice, 0 if it has none
+        self.rotation_uris = array('I')  # uri id per rotation entry
+        self.elapsed = array('Q')  # ms played per rotation entry
+        self.free_slices = {}  # capacity -> offsets of released slices
+        self.extras = {}  # row -> UserExtras
+        self.corrections = None  # batch arrays derived from extras, cached by next_fire_batch
+        self.uris = InternTable()
+        self.timezones = InternTable()
+        self.timezones.intern(None)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, user_id):
+        return user_id in self.rows
+
+    def _allocate(self):
+        if self.free_rows:
+            return self.free_rows.pop()
+        row = len(self.user_ids)
+        self.user_ids.append(None)
+        self.week_masks.extend((0,) * 7)
+        self.play_duration.append(0)
+        self.rotation_index.append(0)
+        self.timezone_ids.append(0)
+        self.rotation_offsets.append(0)
+        self.rotation_lengths.append(0)
+        self.rotation_capacity.append(0)
+        return row
+
+    def _release_slice(self, row):
+        capacity = self.rotation_capacity[row]
+        if capacity:
+            self.free_slices.setdefault(capacity, []).append(self.rotation_offsets[row])
+        self.rotation_capacity[row] = 0
+        self.rotation_lengths[row] = 0
+
+    def _take_slice(self, capacity):
+        free = self.free_slices.get(capacity)
+        if free:
+            return free.pop()
+        offset = len(self.elapsed)
+        self.rotation_uris.extend((0,) * capacity)
+        self.elapsed.extend((0,) * capacity)
+        return offset
+
+    def put(self, user_id, settings, timezone=None):
+        """Store a user's settings (normalize_settings format); returns the row
+
+        ``timezone`` is an IANA name the slots are evaluated in, or None for
+        the local clock. Everything is parsed before the row is touched, so
+        input that raises (e.g. a malformed date key or an unknown time zone)
+        leaves the store as it was.
+        """
+        tz = ZoneInfo(timezone) if timezone else None
+        week = settings.get('baseWeeklySchedule') or settings.get('weeklySchedule') or {}
+        masks = [day_mask(week.get(day)) for day in DAYS]
+        playlists = (settings.get('scheduledPlaylists') or [])[:MAX_ROTATION]
+        playlist_elapsed = settings.get('playlistElapsed') or {}
+        rotation = [(playlist['uri'], int(playlist_elapsed.get(f"playlist_{playlist['id']}", 0)))
+                    for playlist in playlists]
+        overrides = {parse_date_key(key): day_mask(value)
+                     for key, value in (settings.get('dateOverrides') or {}).items()}
+        blocked = frozenset(parse_date_key(key) for key in settings.get('blockedDates') or ())
+        track_positions = {uri: int(ms) for uri, ms in (settings.get('trackPositions') or {}).items() if ms}
+
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self._allocate()
+            self.rows[user_id] = row
+            self.user_ids[row] = user_id
+
+        for day_index, mask in enumerate(masks):
+            self.week_masks[row * 7 + day_index] = mask
+        self.play_duration[row] = settings.get('playDuration') or 30
+        self.rotation_index[row] = settings.get('currentPlaylistIndex') or 0
+        self.timezone_ids[row] = self.timezones.intern(tz)
+
+        if len(rotation) > self.rotation_capacity[row]:
+            # Keep the slice while it is big enough, else swap it for one of the next capacity up
+            self._release_slice(row)
+            capacity = slice_capacity(len(rotation))
+            self.rotation_offsets[row] = self._take_slice(capacity)
+            self.rotation_capacity[row] = capacity
+        self.rotation_lengths[row] = len(rotation)
+        offset = self.rotation_offsets[row]
+        for i, (uri, elapsed) in enumerate(rotation):
+            self.rotation_uris[offset + i] = self.uris.intern(uri)
+            self.elapsed[offset + i] = elapsed
+
+        track_positions = {self.uris.intern(uri): ms for uri, ms in track_positions.items()}
+        # Only rows with extras feed the cached batch corrections
+        if overrides or blocked or track_positions:
+            self.extras[row] = UserExtras(overrides, blocked, track_positions)
+            self.corrections = None
+        elif self.extras.pop(row, None) is not None:
+            self.corrections = None
+        return row
+
+    def remove(self, user_id):
+        row = self.rows.pop(user_id)
+        self.user_ids[row] = None
+        if self.extras.pop(row, None) is not None:
+            self.corrections = None
+        self._release_slice(row)
+        for day_index in range(7):
+            self.week_masks[row * 7 + day_index] = 0
+        self.free_rows.append(row)
+
+    def slot_mask(self, user_id, day):
+        """Effective slot mask on a date (blocked > override > base week)"""
+        row = self.rows[user_id]
+        extras = self.extras.get(row)
+        if extras is not None:
+            ordinal = day.toordinal()
+            if ordinal in extras.blocked:
+                return 0
+            if ordinal in extras.overrides:
+                return extras.overrides[ordinal]
+        return self.week_masks[row * 7 + day.weekday()]
+
+    def timezone(self, user_id):
+        """The row's ZoneInfo, or None when it follows the local clock"""
+        return self.timezones[self.timezone_ids[self.rows[user_id]]]
+
+    def next_fire(self, user_id, after, horizon_days=366):
+        """First enabled slot start strictly after ``after``, like schedule.next_fire"""
+        tz = self.timezone(user_id)
+        if tz is None:
+            return self.next_local_fire(user_id, after, horizon_days)
+        fire_at = self.next_local_fire(user_id, to_local(after, tz), horizon_days)
+        return from_local(fire_at, tz) if fire_at else None
+
+    def next_local_fire(self, user_id, after, horizon_days=366):
+        """next_fire with ``after`` and the result as wall time in the row's own zone"""
+        row = self.rows[user_id]
+        if row not in self.extras and not any(self.week_masks[row * 7:row * 7 + 7]):
+            return None
+
+        day = after.date()
+        since_first = (after - datetime.combine(day, FIRST_SLOT)).total_seconds()
+        first_slot = 0 if since_first < 0 else int(since_first // SLOT_SECONDS) + 1
+        for offset in range(horizon_days + 1):
+            mask = self.slot_mask(user_id, day)
+            if offset == 0:
+                mask = mask >> first_slot << first_slot if first_slot < SLOTS_PER_DAY else 0
+            if mask:
+                slot = (mask & -mask).bit_length() - 1
+                return datetime.combine(day, FIRST_SLOT) + timedelta(seconds=slot * SLOT_SECONDS)
+            day += timedelta(days=1)
+        return None
+
+    def current_playlist(self, user_id):
+        """(playlist URI, elapsed ms) the next slot resumes from, or None"""
+        row = self.rows[user_id]
+        if not self.rotation_lengths[row]:
+            return None
+        entry = self.rotation_offsets[row] + self.rotation_index[row] % self.rotation_lengths[row]
+        return self.uris[self.rotation_uris[entry]], self.elapsed[entry]
+
+    def record_play(self, user_id):
+        """Advance elapsed time and the rotation after a segment, as the zone dispatcher does"""
+        row = self.rows[user_id]
+        if not self.rotation_lengths[row]:
+            return
+        entry = self.rotation_offsets[row] + self.rotation_index[row] % self.rotation_lengths[row]
+        self.elapsed[entry] += self.play_duration[row] * 1000
+        self.rotation_index[row] += 1
+
+    def play_seconds(self, user_id):
+        return self.play_duration[self.rows[user_id]]
+
+    def positions(self, user_id):
+        """(rotation index, [(playlist URI, elapsed ms), ...] in rotation order), for persisting"""
+        row = self.rows[user_id]
+        offset = self.rotation_offsets[row]
+        entries = range(offset, offset + self.rotation_lengths[row])
+        rotation = [(self.uris[self.rotation_uris[entry]], self.elapsed[entry]) for entry in entries]
+        return self.rotation_index[row], rotation
+
+    def nbytes(self):
+        """Approximate memory held by the store, including shared tables"""
+        total = sys.getsizeof(self.rows) + sys.getsizeof(self.user_ids) + sys.getsizeof(self.extras)
+        total += sum(sys.getsizeof(user_id) for user_id in self.rows)
+        for column in (self.week_masks, self.play_duration, self.rotation_index, self.timezone_ids,
+                       self.rotation_offsets, self.rotation_lengths, self.rotation_capacity, self.rotation_uris,
+                       self.elapsed):
+            total += column.buffer_info()[1] * column.itemsize
+        total += sys.getsizeof(self.free_slices) + sum(sys.getsizeof(free) for free in self.free_slices.values())
+        for extras in self.extras.values():
+            total += (sys.getsizeof(extras) + sys.getsizeof(extras.overrides) + sys.getsizeof(extras.blocked)
+                      + sys.getsizeof(extras.track_positions))
+        total += sys.getsizeof(self.uris.ids) + sys.getsizeof(self.uris.values)
+        total += sum(sys.getsizeof(value) for value in self.uris.values)
+        return total
@@ -0,0 +1,450 @@
+"""Headless scheduler daemon.
+
+Runs scheduled playback without a browser tab: account and zone files
+are loaded from a state directory, due slots are fired through the zone
+dispatcher and segments are ended on the timer wheel. Edited files are
+picked up on the next poll, or at once on SIGHUP, without a restart.
+``timezone`` is an IANA name such as ``Europe/Berlin``; slots are matched
+against the wall time there, or against this machine's clock without it.
+
+Schedules, the playlist rotation and resume positions live only in a
+CompactStore, which the daemon reads and advances as slots fire; besides
+its row, each account or zone keeps just its member tokens.
+
+State directory layout::
+
+    users/<user_id>.json  {"access_token", "refresh_token", "expires_at", "device_id", "timezone", "settings": {...}}
+    zones/<zone_id>.json  {"timezone", "settings": {...}, "members": [{"user_id", "access_token", ...}]}
+    positions.json        rotation index and elapsed time per playlist, written from the store
+    tokens.json           access tokens the daemon refreshed, until a file carries a newer one
+    fires.log             write-ahead fire log
+    status.json           heartbeat read by ``status``
+    stacks.collapsed      sampled scheduler ticks, when PROFILER_SAMPLE_RATE is set
+
+Usage::
+
+    python daemon.py run --state-dir ./scheduler-state
+    python daemon.py status
+    python daemon.py reload
+"""
+import asyncio
+import base64
+import heapq
+import json
+import os
+import signal
+import time
+from datetime import datetime, timedelta
+
+import requests
+import typer
+
+from compact_state import CompactStore
+from fire_log import FireLog
+from next_fire_batch import next_fire_batch, rebuild_due_heap
+from playlist_index import PlaylistIndexCache
+from profiler import profiler
+from segments import SegmentController, SpotifyPlayer
+from settings import normalize_settings
+from timer_wheel import TimerWheel
+from zones import ZoneDispatcher, ZoneMember
+
+STATE_DIR = os.environ.get('SCHEDULER_STATE_DIR', 'scheduler-state')
+RELOAD_INTERVAL = float(os.environ.get('SCHEDULER_RELOAD_INTERVAL', '5'))
+# Zones fired at once for one slot; each fire waits out the zone start lead and its play calls
+FIRE_CONCURRENCY = int(os.environ.get('SCHEDULER_FIRE_CONCURRENCY', '64'))
+TOKEN_URL = 'https://accounts.spotify.com/api/token'
+TOKEN_REFRESH_MARGIN = 60  # seconds before expiry
+TICK_PROFILE_LABEL = 'scheduler tick'
+
+
+
+def refresh_access_token(refresh_token):
+    """Exchange a refresh token for a new access token"""
+    client_id = os.environ['SPOTIFY_CLIENT_ID']
+    client_secret = os.environ['SPOTIFY_CLIENT_SECRET']
+    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    response = requests.post(
+        TOKEN_URL,
+        headers={'Authorization': f'Basic {auth_header}', 'Content-Type': 'application/x-www-form-urlencoded'},
+        data={'grant_type': 'refresh_token', 'refresh_token': refresh_token},
+        timeout=10,
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"Token refresh failed with status {response.status_code}")
+    return response.json()
+
+
+def read_rss_kb():
+    """Current resident set size, where /proc is available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return None
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def write_text_atomic(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def playlist_for_uri(uri):
+    """Rotation entry for a stored URI; Spotify playlist URIs end in the playlist id"""
+    return {'id': uri.rsplit(':', 1)[-1], 'uri': uri}
+
+
+class SchedulerDaemon:
+    """Scheduler loop state: loaded zones, a due-heap and the fire log"""
+
+    def __init__(self, state_dir, dispatcher=None, fire_concurrency=FIRE_CONCURRENCY):
+        self.state_dir = state_dir
+        for sub_dir in ('users', 'zones'):
+            os.makedirs(os.path.join(state_dir, sub_dir), exist_ok=True)
+        self.wheel = TimerWheel()
+        self.dispatcher = dispatcher or ZoneDispatcher(
+            PlaylistIndexCache(), SegmentController(SpotifyPlayer(), self.wheel))
+        self.fire_log = FireLog(os.path.join(state_dir, 'fires.log'))
+        self.positions_path = os.path.join(state_dir, 'positions.json')
+        self.tokens_path = os.path.join(state_dir, 'tokens.json')
+        self.status_path = os.path.join(state_dir, 'status.json')
+        self.stacks_path = os.path.join(state_dir, 'stacks.collapsed')
+        self.positions = {}  # positions.json as read at startup, dropped per key once its file loads
+        if os.path.exists(self.positions_path):
+            with open(self.positions_path, encoding='utf-8') as f:
+                self.positions = json.load(f)
+        self.tokens = {}  # tokens.json as read at startup, dropped per key once its file loads
+        if os.path.exists(self.tokens_path):
+            with open(self.tokens_path, encoding='utf-8') as f:
+                self.tokens = json.load(f)
+        self.refreshed = {}  # schedule key -> user ids whose tokens the daemon refreshed
+        self.tokens_changed = False
+
+        self.members = {}  # schedule key -> tuple of ZoneMember; a user file is a zone of one
+        self.store = CompactStore()  # every zone's schedule, rotation and positions
+        self.mtimes = {}  # path -> (schedule key, mtime_ns)
+        self.heap = []  # (fire_at, schedule key), stale entries skipped on pop
+        self.next_due = {}  # schedule key -> fire_at of its live heap entry
+        self.started_at = time.time()
+        self.fired = 0
+        self.failed = 0
+        self.compacted_on = None
+        self.fire_limit = asyncio.Semaphore(fire_concurrency)
+        self.poll_interval = RELOAD_INTERVAL
+        self.reload_event = None
+        self.stopping = False
+
+    def _load_zone(self, kind, name, data):
+        """(schedule key, members, settings, time zone) for a user or zone file"""
+        settings = normalize_settings(data.get('settings') or {})
+        if kind == 'users':
+            key = f"user:{name}"
+            members = (ZoneMember.from_json(name, data),)
+        else:
+            key = f"zone:{name}"
+            members = tuple(ZoneMember.from_json(member['user_id'], member) for member in data.get('members', []))
+        # Positions the daemon advanced win over the file's, whether still in the store or saved before a restart
+        settings.update(self._positions(key) if key in self.store else self.positions.get(key, {}))
+        return key, members, settings, data.get('timezone')
+
+    def _keep_refreshed_tokens(self, key, members):
+        """Put tokens the daemon refreshed back on freshly loaded members when they expire later
+
+        Returns the user ids that took a refreshed token, so it is persisted again.
+        """
+        refreshed = {member.user_id: member for member in self.members.get(key, ())
+                     if member.user_id in self.refreshed.get(key, ())}
+        for user_id, saved in self.tokens.get(key, {}).items():
+            refreshed.setdefault(user_id, ZoneMember.from_json(user_id, saved))
+        kept = set()
+        for member in members:
+            newer = refreshed.get(member.user_id)
+            if newer and newer.expires_at and newer.expires_at > (member.expires_at or 0):
+                member.access_token = newer.access_token
+                member.refresh_token = newer.refresh_token
+                member.expires_at = newer.expires_at
+                kept.add(member.user_id)
+        return kept
+
+    def _positions(self, key):
+        """A key's rotation index and elapsed times in settings form, read from the store"""
+        index, rotation = self.store.positions(key)
+        elapsed = {f"playlist_{playlist_for_uri(uri)['id']}": ms for uri, ms in rotation if ms}
+        return {'currentPlaylistIndex': index, 'playlistElapsed': elapsed}
+
+    def reload(self, now):
+        """Load new or edited files and drop removed ones; returns keys that changed"""
+        seen = set()
+        changed = []
+        for kind in ('users', 'zones'):
+            with os.scandir(os.path.join(self.state_dir, kind)) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.json'):
+                        continue
+                    seen.add(entry.path)
+                    mtime = entry.stat().st_mtime_ns
+                    known = self.mtimes.get(entry.path)
+                    if known and known[1] == mtime:
+                        continue
+                    try:
+                        with open(entry.path, encoding='utf-8') as f:
+                            key, members, settings, timezone = self._load_zone(kind, entry.name[:-5], json.load(f))
+                        # The settings dict is dropped here; the store holds everything fires need
+                        self.store.put(key, settings, timezone)
+                    except (OSError, ValueError, KeyError, TypeError) as e:
+                        # One bad file must not stop the others from loading
+                        print(f"Skipping {entry.path}: {e}")
+                        continue
+                    # A slot already due but not yet fired must survive the reload
+                    due = self.next_due.get(key)
+                    after = due - timedelta(seconds=1) if due and due <= now else now
+                    refreshed = self._keep_refreshed_tokens(key, members)
+                    if refreshed or key in self.refreshed:
+                        self.refreshed[key] = refreshed
+                        self.tokens_changed = True
+                    self.members[key] = members
+                    self.positions.pop(key, None)
+                    self.tokens.pop(key, None)
+                    self.mtimes[entry.path] = (key, mtime)
+                    self._reschedule(key, after)
+                    changed.append(key)
+
+        for path in set(self.mtimes) - seen:
+            key, _ = self.mtimes.pop(path)
+            self.members.pop(key, None)
+            if self.refreshed.pop(key, None) is not None:
+                self.tokens_changed = True
+            if key in self.store:
+                self.store.remove(key)
+            self.next_due.pop(key, None)
+            changed.append(key)
+        return changed
+
+    def _reschedule(self, key, after):
+        self._push(key, self.store.next_fire(key, after))
+
+    def _push(self, key, fire_at):
+        if fire_at is None:
+            self.next_due.pop(key, None)
+            return
+        self.next_due[key] = fire_at
+        heapq.heappush(self.heap, (fire_at, key))
+
+    async def _refresh_tokens(self, key, members):
+        for member in members:
+            if member.refresh_token and member.expires_at and member.expires_at < time.time() + TOKEN_REFRESH_MARGIN:
+                token_info = await asyncio.to_thread(refresh_access_token, member.refresh_token)
+                member.access_token = token_info['access_token']
+                member.refresh_token = token_info.get('refresh_token', member.refresh_token)
+                member.expires_at = time.time() + token_info['expires_in']
+                # Saved to tokens.json, so a reload of the unchanged file does not bring back the old token
+                self.refreshed.setdefault(key, set()).add(member.user_id)
+                self.tokens_changed = True
+
+    async def _fire_all(self, keys, fire_at):
+        """Fire one slot for many zones concurrently, at most fire_limit at a time
+
+        The fire log gets one write for all intents before the fan-out and
+        one for all outcomes after it, so disk syncs do not serialize it.
+        """
+        async def fire_one(key):
+            async with self.fire_limit:
+                return await self._fire(key, fire_at)
+
+        keys = self.fire_log.begin_slot([key for key in keys if key in self.members], fire_at)
+        results = await asyncio.gather(*(fire_one(key) for key in keys))
+        self.fire_log.finish_slot(dict(zip(keys, results)), fire_at)
+        if self.tokens_changed:
+            self._save_tokens()
+
+    async def _fire(self, key, fire_at):
+        """Play one zone's slot and advance its rotation in the store; returns whether any member started"""
+        members = self.members[key]
+        ok = False
+        try:
+            current = self.store.current_playlist(key)
+            if current is None:
+                raise ValueError("no scheduled playlists")
+            uri, elapsed_ms = current
+            if members:
+                await self._refresh_tokens(key, members)
+                results, _ = await self.dispatcher.play(
+                    key, members, playlist_for_uri(uri), elapsed_ms, self.store.play_seconds(key))
+                ok = any(not isinstance(result, Exception) for result in results.values())
+        except Exception as e:
+            print(f"Scheduled fire failed for {key} at {fire_at}: {e}")
+        if ok:
+            # Once per slot, and only if anything played
+            self.store.record_play(key)
+            self.fired += 1
+        else:
+            self.failed += 1
+        return ok
+
+    async def recover(self, now):
+        """Apply the fire log's catch-up policy, then schedule from ``now``"""
+        late = {}  # fire_at -> keys to fire late for that slot
+        for key, fire_at in self.fire_log.recover(self.store, now):
+            late.setdefault(fire_at, []).append(key)
+        for fire_at, keys in sorted(late.items()):
+            await self._fire_all(keys, fire_at)
+        self.heap = rebuild_due_heap(self.store, now)
+        self.next_due = {key: fire_at for fire_at, key in self.heap}
+        self._save_positions()
+
+    async def run_due(self, now):
+        """Fire every slot due at ``now``; returns the next due time or None"""
+        fired = {}  # fire_at -> keys due at that slot, in slot order
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, key = heapq.heappop(self.heap)
+            if self.next_due.get(key) != fire_at:
+                continue
+            fired.setdefault(fire_at, []).append(key)
+
+        for fire_at, keys in fired.items():
+            # Everyone due at a slot starts together rather than one after another
+            await self._fire_all(keys, fire_at)
+            # Slot rollover: reschedule everyone who just fired in one batch per slot
+            for key, next_at in next_fire_batch(self.store, keys, fire_at).items():
+                self._push(key, next_at)
+
+        if fired:
+            self.fire_log.mark_checkpoint(now)
+            self._save_positions()
+        if self.compacted_on != now.date():
+            # Once a day: checkpoint and drop log entries older than a day
+            self.fire_log.mark_checkpoint(now)
+            self.fire_log.compact()
+            self.compacted_on = now.date()
+        return self.heap[0][0] if self.heap else None
+
+    def _save_positions(self):
+        # Written from the store, so zones that no longer exist drop out and the file stays bounded
+        positions = {key: self._positions(key) for key in self.store.rows}
+        write_json_atomic(self.positions_path, {
+            key: value for key, value in positions.items() if value['currentPlaylistIndex'] or value['playlistElapsed']
+        })
+
+    def _save_tokens(self):
+        tokens = {}
+        for key, user_ids in self.refreshed.items():
+            tokens[key] = {
+                member.user_id: {
+                    'access_token': member.access_token,
+                    'refresh_token': member.refresh_token,
+                    'expires_at': member.expires_at,
+                }
+                for member in self.members.get(key, ()) if member.user_id in user_ids
+            }
+        write_json_atomic(self.tokens_path, {key: value for key, value in tokens.items() if value})
+        self.tokens_changed = False
+
+    def status(self, now):
+        next_at = self.heap[0][0] if self.heap else None
+        return {
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'updated_at': time.time(),
+            'zones': len(self.members),
+            'members': sum(len(members) for members in self.members.values()),
+            'next_fire': next_at.isoformat() if next_at else None,
+            'checkpoint': self.fire_log.checkpoint.isoformat() if self.fire_log.checkpoint else None,
+            'fired': self.fired,
+            'failed': self.failed,
+            'segments_active': len(self.dispatcher.segments.active),
+            'rss_kb': read_rss_kb(),
+            'cpu_seconds': round(time.process_time(), 3),
+            'poll_interval': self.poll_interval,
+        }
+
+    def stop(self):
+        """Finish the current iteration and exit the loop"""
+        self.stopping = True
+        if self.reload_event:
+            self.reload_event.set()
+
+    async def run_forever(self, poll_interval=RELOAD_INTERVAL):
+        self.poll_interval = poll_interval
+        loop = asyncio.get_running_loop()
+        self.reload_event = asyncio.Event()
+        loop.add_signal_handler(signal.SIGHUP, self.reload_event.set)
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        wheel_task = asyncio.create_task(self.dispatcher.segments.wheel.run())
+
+        self.reload(datetime.now())
+        await self.recover(datetime.now())
+        try:
+            while not self.stopping:
+                now = datetime.now()
+                with profiler.maybe_profile(TICK_PROFILE_LABEL) as profiled:
+                    self.reload(now)
+                    next_at = await self.run_due(now)
+                if profiled:
+                    write_text_atomic(self.stacks_path, profiler.collapsed(TICK_PROFILE_LABEL))
+                write_json_atomic(self.status_path, self.status(now))
+
+                delay = self.poll_interval
+                if next_at is not None:
+                    delay = min(delay, max((next_at - datetime.now()).total_seconds(), 0))
+                self.reload_event.clear()
+                try:
+                    await asyncio.wait_for(self.reload_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            wheel_task.cancel()
+            self.fire_log.close()
+
+
+cli = typer.Typer(help="Headless Spotify Timer scheduler")
+
+
+@cli.command()
+def run(state_dir: str = typer.Option(STATE_DIR, help="Directory with users/, zones/ and daemon state"),
+        poll_interval: float = typer.Option(RELOAD_INTERVAL, help="Seconds between checks for edited files")):
+    """Run the scheduler loop until interrupted"""
+    try:
+        asyncio.run(SchedulerDaemon(state_dir).run_forever(poll_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+def status(state_dir: str = typer.Option(STATE_DIR)):
+    """Show the running daemon's last heartbeat"""
+    path = os.path.join(state_dir, 'status.json')
+    if not os.path.exists(path):
+        typer.echo("Scheduler has not run in this state directory")
+        raise typer.Exit(1)
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    age = time.time() - data['updated_at']
+    for key, value in data.items():
+        typer.echo(f"{key}: {value}")
+    typer.echo(f"heartbeat_age_s: {age:.1f}")
+    # Judged against the interval the daemon runs with, not this process's default
+    if age > 3 * data.get('poll_interval', RELOAD_INTERVAL):
+        typer.echo("Heartbeat is stale; the daemon may not be running")
+        raise typer.Exit(1)
+
+
+@cli.command()
+def reload(state_dir: str = typer.Option(STATE_DIR)):
+    """Ask the running daemon to reload schedules now"""
+    with open(os.path.join(state_dir, 'status.json'), encoding='utf-8') as f:
+        pid = json.load(f)['pid']
+    os.kill(pid, signal.SIGHUP)
+    typer.echo(f"Sent reload to {pid}")
+
+
+if __name__ == '__main__':
+    cli()
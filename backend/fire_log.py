@@ -0,0 +1,203 @@
+"""Write-ahead log of scheduled fires.
+
+Every fire is recorded as an ``intent`` before the play call and as
+``done`` (or ``fail``) afterwards. The intents of everyone due at a slot
+go out in one fsynced write before the fan-out, the completions in one
+write after it. A ``checkpoint`` records how far the schedule has been
+scanned, so after a restart only the window since the last checkpoint
+needs checking and a slot that already completed is never fired twice.
+
+A crash after the play call but before ``done`` leaves an intent with no
+completion, and recovery cannot tell whether playback started. Such a
+slot is replayed under the catch-up policy, so a slot fires at least
+once and at most twice across a crash, not exactly once.
+
+Schedules are passed either as ``{user_id: settings}`` or as a
+CompactStore; the due set for every user is found in one batch pass
+over the store's slot masks.
+"""
+import json
+import os
+from datetime import timedelta
+
+from compact_state import CompactStore
+from next_fire_batch import fires_between_batch
+from schedule import parse_slot_key, slot_key
+
+# Catch-up policies for slots missed while the process was down
+CATCHUP_SKIP = 'skip'
+CATCHUP_FIRE_ONCE_LATE = 'fire_once_late'
+CATCHUP_GRACE = 'grace'
+CATCHUP_POLICIES = (CATCHUP_SKIP, CATCHUP_FIRE_ONCE_LATE, CATCHUP_GRACE)
+
+CATCHUP_POLICY = os.environ.get('FIRE_CATCHUP_POLICY', CATCHUP_GRACE)
+CATCHUP_GRACE_SECONDS = int(os.environ.get('FIRE_CATCHUP_GRACE_SECONDS', '300'))
+
+# Terminal ops: a slot with any of these is never fired again
+TERMINAL_OPS = ('done', 'fail', 'skip')
+
+
+class FireLog:
+    """Append-only fire log with in-memory per-user slot state"""
+
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint = None
+        self.completed = {}  # user_id -> slot keys with a terminal record
+        self.pending = {}  # user_id -> slot keys with an intent but no terminal record
+        self._replay()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _replay(self):
+        """Rebuild state in a single pass, dropping a torn trailing write"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                # Crashed mid-append: the partial line never committed
+                f.truncate(end)
+
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            op = record['op']
+            if op == 'checkpoint':
+                self.checkpoint = parse_slot_key(record['at'])
+                continue
+            user_id, key = record['user'], record['slot']
+            if op == 'intent':
+                if key not in self.completed.get(user_id, ()):
+                    self.pending.setdefault(user_id, set()).add(key)
+            elif op in TERMINAL_OPS:
+                self.completed.setdefault(user_id, set()).add(key)
+                self.pending.get(user_id, set()).discard(key)
+
+    def _append(self, records):
+        """Write records with a single flush and fsync"""
+        if not records:
+            return
+        self._file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _record(self, entries):
+        """Append (op, user_id, slot key) entries and apply them to the in-memory state"""
+        self._append([{'op': op, 'user': user_id, 'slot': key} for op, user_id, key in entries])
+        for op, user_id, key in entries:
+            if op == 'intent':
+                self.pending.setdefault(user_id, set()).add(key)
+            else:
+                self.completed.setdefault(user_id, set()).add(key)
+                self.pending.get(user_id, set()).discard(key)
+
+    def close(self):
+        self._file.close()
+
+    def is_completed(self, user_id, fire_at):
+        return slot_key(fire_at) in self.completed.get(user_id, ())
+
+    def mark_checkpoint(self, at):
+        """Record that every slot up to ``at`` has been handled"""
+        self.checkpoint = at.replace(second=0, microsecond=0)
+        self._append([{'op': 'checkpoint', 'at': slot_key(self.checkpoint)}])
+
+    def begin_slot(self, user_ids, fire_at):
+        """Record the intent to fire a slot for many users; returns those not yet completed"""
+        key = slot_key(fire_at)
+        to_fire = [user_id for user_id in user_ids if key not in self.completed.get(user_id, ())]
+        self._record([('intent', user_id, key) for user_id in to_fire if key not in self.pending.get(user_id, ())])
+        return to_fire
+
+    def finish_slot(self, results, fire_at):
+        """Record the outcome of a slot from ``{user_id: ok}``"""
+        key = slot_key(fire_at)
+        self._record([('done' if ok else 'fail', user_id, key) for user_id, ok in results.items()])
+
+    def begin(self, user_id, fire_at):
+        """Record the intent to fire; False if the slot already completed"""
+        return bool(self.begin_slot([user_id], fire_at))
+
+    def finish(self, user_id, fire_at, ok=True):
+        self.finish_slot({user_id: ok}, fire_at)
+
+    def due(self, schedules, now):
+        """Slots since the last checkpoint that are due and not completed"""
+        if self.checkpoint is None:
+            return []
+        if not isinstance(schedules, CompactStore):
+            store = CompactStore()
+            for user_id, settings in schedules.items():
+                store.put(user_id, settings)
+            schedules = store
+        return [
+            (user_id, fire_at) for user_id, fire_at in fires_between_batch(schedules, self.checkpoint, now)
+            if slot_key(fire_at) not in self.completed.get(user_id, ())
+        ]
+
+    def recover(self, schedules, now, policy=CATCHUP_POLICY, grace_seconds=CATCHUP_GRACE_SECONDS):
+        """Apply the catch-up policy to slots missed while down
+
+        Returns the (user_id, fire_at) pairs to fire late; every other
+        missed slot, and any intent left by a user no longer scheduled,
+        is recorded as skipped and the log is checkpointed at ``now``.
+        """
+        if policy not in CATCHUP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy: {policy}")
+
+        missed = {}
+        skipped = []
+        for user_id, fire_at in self.due(schedules, now):
+            missed.setdefault(user_id, set()).add(fire_at)
+        for user_id, keys in self.pending.items():
+            if not keys:
+                continue
+            if user_id in schedules:
+                missed.setdefault(user_id, set()).update(parse_slot_key(key) for key in keys)
+            else:
+                skipped.extend(('skip', user_id, key) for key in sorted(keys))
+
+        grace = timedelta(seconds=grace_seconds)
+        to_fire = []
+        for user_id, slots in missed.items():
+            latest = max(slots)
+            if policy == CATCHUP_FIRE_ONCE_LATE or (policy == CATCHUP_GRACE and now - latest <= grace):
+                to_fire.append((user_id, latest))
+                slots.discard(latest)
+            skipped.extend(('skip', user_id, slot_key(fire_at)) for fire_at in sorted(slots))
+
+        self._record(skipped)
+        self.mark_checkpoint(now)
+        return to_fire
+
+    def compact(self, keep=timedelta(days=1)):
+        """Rewrite the log keeping the checkpoint and recent intents and completions
+
+        Anything older than ``keep`` before the checkpoint is behind every
+        catch-up window, so it is dropped, as are users left with no slots.
+        """
+        cutoff = slot_key(self.checkpoint - keep) if self.checkpoint else None
+        for state in (self.completed, self.pending):
+            for user_id in list(state):
+                keys = state[user_id]
+                if cutoff is not None:
+                    keys.difference_update([key for key in keys if key < cutoff])
+                if not keys:
+                    del state[user_id]
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for user_id, keys in self.completed.items():
+                for key in sorted(keys):
+                    f.write(json.dumps({'op': 'done', 'user': user_id, 'slot': key}, separators=(',', ':')) + '\n')
+            for user_id, keys in self.pending.items():
+                for key in sorted(keys):
+                    f.write(json.dumps({'op': 'intent', 'user': user_id, 'slot': key}, separators=(',', ':')) + '\n')
+            if self.checkpoint:
+                f.write(json.dumps({'op': 'checkpoint', 'at': slot_key(self.checkpoint)}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
@@ -0,0 +1,202 @@
+"""Vectorised next-fire computation over a CompactStore.
+
+Rebuilding the due-heap after a restart, or rescheduling everyone who
+fired at a slot boundary, would otherwise call next_fire once per user.
+Here each upcoming day is one NumPy pass over the packed weekly masks:
+take that weekday's column, overwrite rows with a date override, zero
+rows blocked that day, then take the lowest set bit of every still
+unresolved row. A non-empty week always fires within eight days, so
+only users whose sole slots are overrides beyond that fall back to the
+scalar path. The same per-day masks give every slot in a window, which
+the fire log uses to find missed fires after a restart.
+
+Rows with their own time zone are computed per zone: the caller's time
+is turned into that zone's wall time, and the slot times found are
+turned back, once per distinct slot time rather than once per row.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from compact_state import FIRST_SLOT, SLOTS_PER_DAY, from_local, to_local
+
+BATCH_HORIZON_DAYS = 8
+EPOCH = datetime(1970, 1, 1)
+NO_FIRE = -1
+
+
+def _corrections(store):
+    """Overrides and blocked dates as flat (row, ordinal[, mask]) arrays
+
+    Built once and cached on the store until a put or remove touches a
+    row with extras, so a slot rollover does not rescan every user.
+    """
+    if store.corrections is not None:
+        return store.corrections
+    override_rows, override_ordinals, override_masks = [], [], []
+    blocked_rows, blocked_ordinals = [], []
+    for row, extras in store.extras.items():
+        for ordinal, mask in extras.overrides.items():
+            override_rows.append(row)
+            override_ordinals.append(ordinal)
+            override_masks.append(mask)
+        for ordinal in extras.blocked:
+            blocked_rows.append(row)
+            blocked_ordinals.append(ordinal)
+    store.corrections = (
+        np.array(override_rows, dtype=np.int64), np.array(override_ordinals, dtype=np.int64),
+        np.array(override_masks, dtype=np.uint32),
+        np.array(blocked_rows, dtype=np.int64), np.array(blocked_ordinals, dtype=np.int64),
+    )
+    return store.corrections
+
+
+def _apply_corrections(masks, ordinal, corrections):
+    """Overwrite overridden rows and zero blocked rows of one day's masks in place"""
+    override_pos, override_ordinals, override_masks, blocked_pos, blocked_ordinals = corrections
+    on_day = override_ordinals == ordinal
+    masks[override_pos[on_day]] = override_masks[on_day]
+    masks[blocked_pos[blocked_ordinals == ordinal]] = 0
+
+
+def _timezone_groups(store, rows):
+    """(ZoneInfo or None, mask over ``rows``) for each time zone among ``rows``"""
+    timezone_ids = np.frombuffer(store.timezone_ids, dtype=np.uint16)[rows]
+    return [(store.timezones[timezone_id], timezone_ids == timezone_id)
+            for timezone_id in np.unique(timezone_ids).tolist()]
+
+
+def _minutes_from_local(minutes, tz):
+    """Wall-time minutes in ``tz`` as minutes on the local clock, NO_FIRE kept"""
+    fires = minutes != NO_FIRE
+    unique_minutes, inverse = np.unique(minutes[fires], return_inverse=True)
+    converted = [
+        int((from_local(EPOCH + timedelta(minutes=minute), tz) - EPOCH).total_seconds() // 60)
+        for minute in unique_minutes.tolist()
+    ]
+    result = minutes.copy()
+    result[fires] = np.array(converted, dtype=np.int64)[inverse]
+    return result
+
+
+def next_fire_minutes(store, after, rows=None, horizon_days=BATCH_HORIZON_DAYS):
+    """Next fire of each row (or of ``rows``) as minutes since the epoch, NO_FIRE if none"""
+    rows = np.arange(len(store.user_ids)) if rows is None else np.asarray(rows, dtype=np.int64)
+    groups = _timezone_groups(store, rows)
+    if len(groups) == 1 and groups[0][0] is None:
+        return _next_local_fire_minutes(store, after, rows, horizon_days)
+    result = np.full(len(rows), NO_FIRE, dtype=np.int64)
+    for tz, in_zone in groups:
+        if tz is None:
+            result[in_zone] = _next_local_fire_minutes(store, after, rows[in_zone], horizon_days)
+        else:
+            minutes = _next_local_fire_minutes(store, to_local(after, tz), rows[in_zone], horizon_days)
+            result[in_zone] = _minutes_from_local(minutes, tz)
+    return result
+
+
+def _next_local_fire_minutes(store, after, rows, horizon_days):
+    """next_fire_minutes for rows that share one zone, with ``after`` and the result in its wall time"""
+    total_rows = len(store.user_ids)
+    week = np.frombuffer(store.week_masks, dtype=np.uint32).reshape(total_rows, 7)[rows]
+
+    # Corrections are addressed by position within ``rows``
+    position = np.full(total_rows, -1, dtype=np.int64)
+    position[rows] = np.arange(len(rows))
+    override_rows, override_ordinals, override_masks, blocked_rows, blocked_ordinals = _corrections(store)
+    override_pos, blocked_pos = position[override_rows], position[blocked_rows]
+    keep = override_pos >= 0
+    override_pos, override_ordinals, override_masks = override_pos[keep], override_ordinals[keep], override_masks[keep]
+    keep = blocked_pos >= 0
+    blocked_pos, blocked_ordinals = blocked_pos[keep], blocked_ordinals[keep]
+    corrections = (override_pos, override_ordinals, override_masks, blocked_pos, blocked_ordinals)
+
+    has_extras = np.zeros(len(rows), dtype=bool)
+    has_extras[override_pos] = True
+    has_extras[blocked_pos] = True
+    pending = week.any(axis=1) | has_extras
+
+    day = after.date()
+    first_minute = int((datetime.combine(day, FIRST_SLOT) - EPOCH).total_seconds() // 60)
+    since_first = (after - datetime.combine(day, FIRST_SLOT)).total_seconds()
+    first_slot = 0 if since_first < 0 else int(since_first // 1800) + 1
+
+    result = np.full(len(rows), NO_FIRE, dtype=np.int64)
+    for offset in range(horizon_days):
+        if not pending.any():
+            break
+        masks = week[:, (day.weekday() + offset) % 7].copy()
+        _apply_corrections(masks, day.toordinal() + offset, corrections)
+        if offset == 0:
+            masks &= np.uint32(~((1 << min(first_slot, SLOTS_PER_DAY)) - 1) & 0xFFFFFFFF)
+
+        hit = pending & (masks != 0)
+        hit_masks = masks[hit]
+        lowest_bit = hit_masks & (~hit_masks + np.uint32(1))
+        slots = np.log2(lowest_bit).astype(np.int64)  # exact for powers of two
+        result[hit] = first_minute + offset * 1440 + slots * 30
+        pending &= ~hit
+
+    # Past the horizon only far-off overrides can fire; resolve those one by one
+    for index in np.flatnonzero(pending & has_extras):
+        fire_at = store.next_local_fire(store.user_ids[rows[index]], after)
+        if fire_at is not None:
+            result[index] = int((fire_at - EPOCH).total_seconds() // 60)
+    return result
+
+
+def next_fire_batch(store, user_ids, after):
+    """next_fire for many users at once; returns {user_id: datetime or None}"""
+    rows = [store.rows[user_id] for user_id in user_ids]
+    minutes = next_fire_minutes(store, after, rows)
+    return {
+        user_id: EPOCH + timedelta(minutes=int(minute)) if minute != NO_FIRE else None
+        for user_id, minute in zip(user_ids, minutes.tolist())
+    }
+
+
+def fires_between_batch(store, start, end):
+    """Every (user_id, fire_at) with start < fire_at <= end, ordered by fire_at
+
+    One pass per day in the window (per time zone in use), one mask test
+    per slot of that day, whatever the number of users.
+    """
+    total_rows = len(store.user_ids)
+    week = np.frombuffer(store.week_masks, dtype=np.uint32).reshape(total_rows, 7)
+    corrections = _corrections(store)
+    user_ids = store.user_ids
+    groups = _timezone_groups(store, np.arange(total_rows))
+    fires = []
+    for tz, in_zone in groups:
+        local_start, local_end = (start, end) if tz is None else (to_local(start, tz), to_local(end, tz))
+        day = local_start.date()
+        while day <= local_end.date():
+            masks = week[:, day.weekday()].copy()
+            _apply_corrections(masks, day.toordinal(), corrections)
+            if len(groups) > 1:
+                masks[~in_zone] = 0
+            first = datetime.combine(day, FIRST_SLOT)
+            for slot in range(SLOTS_PER_DAY):
+                fire_at = first + timedelta(minutes=slot * 30)
+                if tz is not None:
+                    fire_at = from_local(fire_at, tz)
+                if start < fire_at <= end:
+                    hits = np.flatnonzero(masks & np.uint32(1 << slot)).tolist()
+                    fires.extend((user_ids[row], fire_at) for row in hits)
+            day += timedelta(days=1)
+    if len(groups) > 1:
+        fires.sort(key=lambda fire: fire[1])
+    return fires
+
+
+def rebuild_due_heap(store, after):
+    """Due-heap of (fire_at, user_id) for every user with an upcoming fire"""
+    minutes = next_fire_minutes(store, after)
+    order = np.flatnonzero(minutes != NO_FIRE)
+    order = order[np.argsort(minutes[order], kind='stable')]
+    # Users share a handful of slot times, so build each datetime once
+    unique_minutes, inverse = np.unique(minutes[order], return_inverse=True)
+    times = [EPOCH + timedelta(minutes=int(minute)) for minute in unique_minutes.tolist()]
+    user_ids = store.user_ids
+    # A list sorted by key already satisfies the heap invariant
+    return [(times[i], user_ids[row]) for i, row in zip(inverse.tolist(), order.tolist())]
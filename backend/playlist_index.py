@@ -0,0 +1,87 @@
+"""Playlist duration index, the backend twin of buildDurationIndex in App.js.
+
+Prefix sums over track durations live in a compact ``array('d')`` so that
+total time played in a playlist maps to (track index, offset ms) with a
+binary search. Indexes are cached per playlist and rebuilt only when the
+playlist's snapshot_id changes.
+"""
+import asyncio
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+import requests
+
+SPOTIFY_API_URL = 'https://api.spotify.com/v1'
+DEFAULT_TRACK_DURATION_MS = 210000  # Default 3.5 mins when duration_ms is missing
+
+
+class PlaylistIndex:
+    __slots__ = ('snapshot_id', 'uris', 'cumulative')
+
+    def __init__(self, snapshot_id, uris, durations):
+        self.snapshot_id = snapshot_id
+        self.uris = uris
+        self.cumulative = array('d', [0.0])
+        for duration in durations:
+            self.cumulative.append(self.cumulative[-1] + (duration or DEFAULT_TRACK_DURATION_MS))
+
+    @property
+    def total_ms(self):
+        return self.cumulative[-1]
+
+    def locate(self, elapsed_ms):
+        """Map total ms played to (track index, offset ms), wrapping at the end"""
+        if not self.uris:
+            raise ValueError('No playable tracks in playlist')
+        position = elapsed_ms % self.total_ms if self.total_ms > 0 else 0
+        index = bisect_right(self.cumulative, position, 0, len(self.uris)) - 1
+        return index, position - self.cumulative[index]
+
+
+def spotify_get(url, access_token):
+    response = requests.get(url, headers={'Authorization': f'Bearer {access_token}'}, timeout=10)
+    if response.status_code != 200:
+        raise RuntimeError(f"Spotify request failed with status {response.status_code}")
+    return response.json()
+
+
+class PlaylistIndexCache:
+    """Duration indexes keyed by playlist id, invalidated on snapshot change
+
+    At most ``max_entries`` indexes are kept, least recently used first out.
+    """
+
+    def __init__(self, fetch_json=spotify_get, max_entries=1024):
+        self.fetch_json = fetch_json
+        self.max_entries = max_entries
+        self.indexes = OrderedDict()
+
+    async def _get(self, url, access_token):
+        return await asyncio.to_thread(self.fetch_json, url, access_token)
+
+    async def get(self, playlist_id, access_token):
+        """One snapshot call per lookup; track pages only when the snapshot moved"""
+        snapshot = await self._get(f"{SPOTIFY_API_URL}/playlists/{playlist_id}?fields=snapshot_id", access_token)
+        cached = self.indexes.get(playlist_id)
+        if cached and cached.snapshot_id == snapshot['snapshot_id']:
+            self.indexes.move_to_end(playlist_id)
+            return cached
+
+        uris, durations = [], []
+        url = f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks?fields=items(track(uri,duration_ms)),next&limit=100"
+        while url:
+            page = await self._get(url, access_token)
+            for item in page['items']:
+                track = item.get('track')
+                if track and track.get('uri'):
+                    uris.append(track['uri'])
+                    durations.append(track.get('duration_ms'))
+            url = page.get('next')
+
+        index = PlaylistIndex(snapshot['snapshot_id'], uris, durations)
+        self.indexes[playlist_id] = index
+        self.indexes.move_to_end(playlist_id)
+        while len(self.indexes) > self.max_entries:
+            self.indexes.popitem(last=False)
+        return index
@@ -0,0 +1,173 @@
+"""Opt-in statistical sampling profiler.
+
+A sampled request (or scheduler tick) gets a helper thread that reads the
+running thread's stack every few milliseconds via ``sys._current_frames``.
+On an event loop the thread also runs every other task, so a sample only
+counts when the profiled coroutine's frame is on the stack. Stacks are
+folded into flamegraph-ready collapsed lines and kept in a bounded ring
+buffer. When profiling is off the middleware is a single attribute check
+in front of the app.
+"""
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', '0'))
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', '5'))
+PROFILER_CAPACITY = int(os.environ.get('PROFILER_CAPACITY', '64'))
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+# Rate used when profiling is switched on without one and none is configured
+PROFILER_ENABLE_RATE = 0.01
+PROFILER_HEADER = b'x-profile'
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+def collapse_stack(frame, anchor=None):
+    """Fold a frame chain into a root-first 'a;b;c' line
+
+    With ``anchor``, returns None unless that frame is on the chain.
+    """
+    names = []
+    found = anchor is None
+    while frame is not None:
+        names.append(_frame_name(frame))
+        found = found or frame is anchor
+        frame = frame.f_back
+    return ';'.join(reversed(names)) if found else None
+
+
+class _Sampler(threading.Thread):
+    """Samples one target thread until stopped"""
+
+    def __init__(self, thread_id, interval, anchor=None):
+        super().__init__(name='profiler-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.anchor = anchor
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = collapse_stack(frame, self.anchor) if frame is not None else None
+            del frame
+            if stack is None:
+                continue
+            with self._lock:
+                if self._stop_event.is_set():
+                    break
+                self.stacks[stack] += 1
+        self.anchor = None
+
+    def stop(self):
+        """Stop sampling without waiting for the thread, which may be mid-sample"""
+        with self._lock:
+            self._stop_event.set()
+        return self.stacks
+
+
+class SamplingProfiler:
+    """Sampling profiler with a bounded ring buffer of recorded profiles"""
+
+    def __init__(self, sample_rate=PROFILER_SAMPLE_RATE, interval_ms=PROFILER_INTERVAL_MS, capacity=PROFILER_CAPACITY):
+        self.sample_rate = sample_rate
+        self.enabled = sample_rate > 0
+        self.interval = interval_ms / 1000
+        self.profiles = deque(maxlen=capacity)
+
+    def configure(self, enabled, sample_rate=None):
+        if sample_rate is not None:
+            self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        elif enabled and not self.sample_rate:
+            self.sample_rate = PROFILER_ENABLE_RATE
+        self.enabled = enabled
+
+    def should_sample(self):
+        return self.enabled and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, label, frame=None):
+        """Sample the calling thread for the duration of the block
+
+        Pass the profiled coroutine's ``frame`` when running on an event
+        loop so samples taken while other tasks run are left out.
+        """
+        sampler = _Sampler(threading.get_ident(), self.interval, frame)
+        started = time.time()
+        sampler.start()
+        try:
+            yield True
+        finally:
+            stacks = sampler.stop()
+            self.profiles.append({
+                'label': label,
+                'started_at': started,
+                'duration_ms': (time.time() - started) * 1000,
+                'stacks': stacks,
+            })
+
+    def maybe_profile(self, label):
+        """Profile the block when this call is sampled, e.g. a scheduler tick
+
+        Only samples taken while the caller's frame is on the stack count,
+        so this is safe to use from a coroutine. Yields whether it profiles.
+        """
+        if self.enabled and self.should_sample():
+            return self.profile(label, sys._getframe(1))
+        return nullcontext(False)
+
+    def collapsed(self, label=None):
+        """Merged collapsed stacks ('frame;frame;frame count' per line)"""
+        merged = Counter()
+        for entry in list(self.profiles):
+            if label is None or entry['label'] == label:
+                merged.update(entry['stacks'])
+        return ''.join(f"{stack} {count}\n" for stack, count in merged.most_common())
+
+    def summary(self):
+        return [
+            {'label': entry['label'], 'started_at': entry['started_at'],
+             'duration_ms': round(entry['duration_ms'], 3), 'samples': sum(entry['stacks'].values())}
+            for entry in list(self.profiles)
+        ]
+
+    def clear(self):
+        self.profiles.clear()
+
+
+profiler = SamplingProfiler()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling sampled requests or ones carrying X-Profile"""
+
+    def __init__(self, app, profiler=profiler, token=PROFILER_TOKEN):
+        self.app = app
+        self.profiler = profiler
+        self.token = token.encode() if token else None
+
+    def _has_token(self, scope):
+        for name, value in scope['headers']:
+            if name == PROFILER_HEADER:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if not (self.profiler.enabled or self.token) or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        if self.profiler.should_sample() or (self.token and self._has_token(scope)):
+            with self.profiler.profile(f"{scope['method']} {scope['path']}", sys._getframe()):
+                return await self.app(scope, receive, send)
+        return await self.app(scope, receive, send)
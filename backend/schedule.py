@@ -0,0 +1,102 @@
+"""Schedule resolution shared by the API and the scheduler.
+
+Mirrors the layered model used by the frontend: a base weekly schedule,
+per-date overrides and blocked dates, each day holding ``wholeDay`` and
+``timeSlots`` keyed by ``"HH:MM"``.
+"""
+from datetime import datetime, time, timedelta
+
+# Days of the week
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def generate_time_slots():
+    """Time slots from 7:00 to 17:00 (30-min intervals)"""
+    slots = []
+    for hour in range(7, 18):
+        slots.append(f"{hour:02d}:00")
+        if hour < 17:
+            slots.append(f"{hour:02d}:30")
+    return slots
+
+
+TIME_SLOTS = generate_time_slots()
+SLOT_TIMES = [time(int(slot[:2]), int(slot[3:])) for slot in TIME_SLOTS]
+
+
+def format_date_key(day):
+    """Format a date as the YYYY-MM-DD key used by overrides and blocked dates"""
+    return f"{day.year}-{day.month:02d}-{day.day:02d}"
+
+
+def slot_key(fire_at):
+    """Stable identifier for a slot start, e.g. 2024-05-06T07:30"""
+    return fire_at.strftime('%Y-%m-%dT%H:%M')
+
+
+def parse_slot_key(key):
+    """Inverse of slot_key"""
+    return datetime.strptime(key, '%Y-%m-%dT%H:%M')
+
+
+def base_schedule(settings):
+    """Base weekly schedule, falling back to the legacy weeklySchedule"""
+    return settings.get('baseWeeklySchedule') or settings.get('weeklySchedule') or {}
+
+
+def get_effective_schedule(settings, day):
+    """Resolve the schedule that applies on a date (blocked > override > base)"""
+    date_key = format_date_key(day)
+
+    if date_key in settings.get('blockedDates', ()):
+        return {'blocked': True}
+
+    overrides = settings.get('dateOverrides') or {}
+    if date_key in overrides:
+        return {'override': True, 'schedule': overrides[date_key]}
+
+    return {'base': True, 'schedule': base_schedule(settings).get(DAYS[day.weekday()])}
+
+
+def enabled_slots(settings, day):
+    """Slot times enabled on a date, in chronological order"""
+    effective = get_effective_schedule(settings, day)
+    schedule = effective.get('schedule')
+    if effective.get('blocked') or not schedule:
+        return []
+    if schedule.get('wholeDay'):
+        return list(SLOT_TIMES)
+    time_slots = schedule.get('timeSlots') or {}
+    return [slot_time for slot, slot_time in zip(TIME_SLOTS, SLOT_TIMES) if time_slots.get(slot)]
+
+
+def fires_between(settings, start, end):
+    """Yield slot starts with start < fire_at <= end, jumping day by day"""
+    day = start.date()
+    while day <= end.date():
+        for slot_time in enabled_slots(settings, day):
+            fire_at = datetime.combine(day, slot_time)
+            if start < fire_at <= end:
+                yield fire_at
+        day += timedelta(days=1)
+
+
+def next_fire(settings, after, horizon_days=366):
+    """First slot start strictly after ``after``, or None within the horizon"""
+    day = after.date()
+    for _ in range(horizon_days + 1):
+        for slot_time in enabled_slots(settings, day):
+            fire_at = datetime.combine(day, slot_time)
+            if fire_at > after:
+                return fire_at
+        day += timedelta(days=1)
+    return None
+
+
+def slot_containing(settings, moment):
+    """Start of the enabled 30-minute slot that contains ``moment``, if any"""
+    for slot_time in reversed(enabled_slots(settings, moment.date())):
+        fire_at = datetime.combine(moment.date(), slot_time)
+        if fire_at <= moment < fire_at + timedelta(minutes=30):
+            return fire_at
+    return None
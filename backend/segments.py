@@ -0,0 +1,110 @@
+"""Server-owned playback segments.
+
+Starting a segment sends the play call and schedules the matching pause
+on the timer wheel, so a segment ends on time even when the browser tab
+is throttled or closed. The pause is pulled forward by the expected
+one-way latency of the pause call and pushed back by the one-way latency
+of the play call just measured, so audible playback lasts ``duration``.
+"""
+import asyncio
+
+import requests
+
+SPOTIFY_ME_URL = 'https://api.spotify.com/v1/me'
+SPOTIFY_PLAYER_URL = f'{SPOTIFY_ME_URL}/player'
+
+# Weight of the newest round trip in the per-user latency estimate
+LATENCY_SMOOTHING = 0.2
+
+
+class SpotifyPlayer:
+    """Web API player endpoints, run off the event loop"""
+
+    async def play(self, access_token, body, device_id=None):
+        await asyncio.to_thread(self._put, 'play', access_token, body, device_id)
+
+    async def pause(self, access_token, device_id=None):
+        await asyncio.to_thread(self._put, 'pause', access_token, None, device_id)
+
+    async def user_id(self, access_token):
+        """Spotify user id owning ``access_token``"""
+        return await asyncio.to_thread(self._get_user_id, access_token)
+
+    def _get_user_id(self, access_token):
+        response = requests.get(SPOTIFY_ME_URL, headers={'Authorization': f'Bearer {access_token}'}, timeout=10)
+        if response.status_code != 200:
+            raise RuntimeError(f"Spotify profile lookup failed with status {response.status_code}")
+        return response.json()['id']
+
+    def _put(self, action, access_token, body, device_id):
+        response = requests.put(
+            f"{SPOTIFY_PLAYER_URL}/{action}",
+            headers={'Authorization': f'Bearer {access_token}'},
+            params={'device_id': device_id} if device_id else None,
+            json=body,
+            timeout=10,
+        )
+        if response.status_code not in (200, 202, 204):
+            raise RuntimeError(f"Spotify {action} failed with status {response.status_code}")
+
+
+class Segment:
+    __slots__ = ('user_id', 'sent_at', 'round_trip', 'duration', 'stop_at', 'handle')
+
+    def __init__(self, user_id, sent_at, round_trip, duration, stop_at):
+        self.user_id = user_id
+        self.sent_at = sent_at
+        self.round_trip = round_trip
+        self.duration = duration
+        self.stop_at = stop_at
+        self.handle = None
+
+
+class SegmentController:
+    """Starts segments and pauses them at start + duration on the timer wheel"""
+
+    def __init__(self, player, wheel):
+        self.player = player
+        self.wheel = wheel
+        self.active = {}  # user_id -> Segment
+        self.latency = {}  # user_id -> smoothed play/pause round trip in seconds
+
+    def estimated_latency(self, user_id):
+        return self.latency.get(user_id)
+
+    async def start(self, user_id, access_token, body, duration, device_id=None, on_end=None):
+        """Play ``body`` now and schedule the pause; replaces any running segment"""
+        self.cancel(user_id)
+
+        sent_at = self.wheel.clock()
+        await self.player.play(access_token, body, device_id)
+        round_trip = self.wheel.clock() - sent_at
+
+        estimate = self.latency.get(user_id, round_trip)
+        estimate += LATENCY_SMOOTHING * (round_trip - estimate)
+        self.latency[user_id] = estimate
+
+        # Audio starts about half a round trip after sending; the pause lands half a round trip after it is sent
+        stop_at = sent_at + round_trip / 2 + duration - estimate / 2
+        segment = Segment(user_id, sent_at, round_trip, duration, stop_at)
+        segment.handle = self.wheel.schedule(stop_at, lambda: self._stop(segment, access_token, device_id, on_end))
+        self.active[user_id] = segment
+        return segment
+
+    async def _stop(self, segment, access_token, device_id, on_end):
+        if self.active.get(segment.user_id) is not segment:
+            return
+        del self.active[segment.user_id]
+        try:
+            await self.player.pause(access_token, device_id)
+        except Exception as e:
+            print(f"Failed to end segment for {segment.user_id}: {e}")
+        if on_end:
+            on_end(segment)
+
+    def cancel(self, user_id):
+        """Drop the pending pause for a user's running segment, if any"""
+        segment = self.active.pop(user_id, None)
+        if segment:
+            segment.handle.cancel()
+        return segment
@@ -1,35 +1,69 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import Body, Depends, FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from mangum import Mangum
+from pydantic import BaseModel
+from typing import List, Optional
+from collections import OrderedDict
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import asyncio
+import hmac
 import os
+import re
 import requests
 import urllib.parse
 import base64
 
+from playlist_index import PlaylistIndexCache
+from profiler import ProfilingMiddleware, profiler
+from segments import SegmentController, SpotifyPlayer
+from settings import normalize_settings
+from timer_wheel import TimerWheel
+from zones import Zone, ZoneDispatcher, ZoneMember, read_zone_file, write_zone_file
+
 app = FastAPI()
+app.add_middleware(ProfilingMiddleware)
 
 # Spotify configuration
 CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', 'b8df048a15f4402a866d7253a435139e')
 CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', 'a88333b28daf49ea927f159c6454dd60')
 REDIRECT_URI = 'https://spotify-timer.vercel.app/api/auth/callback'
+FRONTEND_URL = 'https://spotify-timer.vercel.app'
+SCOPES = 'user-read-playback-state user-modify-playback-state user-read-private streaming user-read-email'
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def require_admin(x_admin_token: str = Header(None)):
+    """Reject requests without the admin token"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
 
 @app.get("/api/")
 async def root():
     return {"message": "Spotify Timer API"}
 
-@app.get("/api/auth/login")
-async def spotify_login():
-    """Generate Spotify authorization URL"""
+def build_authorize_url():
+    """Spotify authorization URL for the login redirect"""
     params = {
         'client_id': CLIENT_ID,
         'response_type': 'code',
         'redirect_uri': REDIRECT_URI,
-        'scope': 'user-read-playback-state user-modify-playback-state user-read-private streaming user-read-email',
+        'scope': SCOPES,
         'show_dialog': 'true'
     }
-    
-    auth_url = 'https://accounts.spotify.com/authorize?' + urllib.parse.urlencode(params)
-    return {"auth_url": auth_url}
+    return 'https://accounts.spotify.com/authorize?' + urllib.parse.urlencode(params)
+
+def build_frontend_callback_url(token_info):
+    """Frontend URL carrying the tokens from a Spotify token response"""
+    access_token = token_info['access_token']
+    refresh_token = token_info['refresh_token']
+    expires_in = token_info['expires_in']
+    return f"{FRONTEND_URL}?access_token={urllib.parse.quote(access_token)}&refresh_token={urllib.parse.quote(refresh_token)}&expires_in={expires_in}"
+
+@app.get("/api/auth/login")
+async def spotify_login():
+    """Generate Spotify authorization URL"""
+    return {"auth_url": build_authorize_url()}
 
 @app.get("/api/auth/callback")
 async def spotify_callback(code: str):
@@ -54,21 +88,203 @@ async def spotify_callback(code: str):
         response = requests.post(token_url, headers=headers, data=data)
         
         if response.status_code == 200:
-            token_info = response.json()
-            access_token = token_info['access_token']
-            refresh_token = token_info['refresh_token']
-            expires_in = token_info['expires_in']
-            
             # Redirect to frontend with tokens
-            frontend_url = 'https://spotify-timer.vercel.app'
-            callback_url = f"{frontend_url}?access_token={urllib.parse.quote(access_token)}&refresh_token={urllib.parse.quote(refresh_token)}&expires_in={expires_in}"
-            
-            return RedirectResponse(url=callback_url)
+            return RedirectResponse(url=build_frontend_callback_url(response.json()))
         else:
             raise HTTPException(status_code=400, detail="Failed to get access token")
             
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Authentication failed: {str(e)}")
 
+@app.post("/api/admin/profiler", dependencies=[Depends(require_admin)])
+async def configure_profiler(enabled: bool, sample_rate: float = None):
+    """Turn request sampling on or off; enabling without a rate samples 1% unless a rate is already set"""
+    profiler.configure(enabled, sample_rate)
+    return {"enabled": profiler.enabled, "sample_rate": profiler.sample_rate}
+
+@app.get("/api/admin/profiler", dependencies=[Depends(require_admin)])
+async def profiler_status():
+    """List recorded profiles"""
+    return {"enabled": profiler.enabled, "sample_rate": profiler.sample_rate, "profiles": profiler.summary()}
+
+@app.get("/api/admin/profiler/stacks", dependencies=[Depends(require_admin)])
+async def profiler_stacks(label: str = None):
+    """Download collapsed stacks for flamegraph.pl or speedscope"""
+    return PlainTextResponse(profiler.collapsed(label), headers={"Content-Disposition": "attachment; filename=stacks.collapsed"})
+
+@app.delete("/api/admin/profiler", dependencies=[Depends(require_admin)])
+async def clear_profiles():
+    """Drop recorded profiles"""
+    profiler.clear()
+    return {"cleared": True}
+
+# Segment lifecycle: the backend pauses playback when a segment's duration is up
+wheel = TimerWheel()
+segments = SegmentController(SpotifyPlayer(), wheel)
+
+# Segments are keyed by the Spotify user owning the token, never by a client-supplied id
+USER_ID_CACHE_SIZE = 4096
+user_ids = OrderedDict()  # access token -> Spotify user id, least recently used first
+
+async def spotify_user_id(access_token):
+    """Resolve the user owning an access token, calling /v1/me once per token"""
+    user_id = user_ids.get(access_token)
+    if user_id is not None:
+        user_ids.move_to_end(access_token)
+        return user_id
+    try:
+        user_id = await segments.player.user_id(access_token)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid access token")
+    user_ids[access_token] = user_id
+    if len(user_ids) > USER_ID_CACHE_SIZE:
+        user_ids.popitem(last=False)
+    return user_id
+
+class SegmentRequest(BaseModel):
+    access_token: str
+    duration: float  # seconds
+    context_uri: Optional[str] = None
+    uris: Optional[List[str]] = None
+    offset: Optional[dict] = None
+    position_ms: int = 0
+    device_id: Optional[str] = None
+
+class SegmentStopRequest(BaseModel):
+    access_token: str
+    device_id: Optional[str] = None
+
+@app.on_event("startup")
+async def start_timer_wheel():
+    asyncio.create_task(wheel.run())
+
+@app.post("/api/segments/start")
+async def start_segment(request: SegmentRequest):
+    """Start playback and schedule the pause at start + duration"""
+    body = {'position_ms': request.position_ms}
+    if request.context_uri:
+        body['context_uri'] = request.context_uri
+    if request.uris:
+        body['uris'] = request.uris
+    if request.offset:
+        body['offset'] = request.offset
+
+    user_id = await spotify_user_id(request.access_token)
+    try:
+        segment = await segments.start(user_id, request.access_token, body, request.duration, request.device_id)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Playback failed: {str(e)}")
+
+    return {
+        "stop_in_ms": round((segment.stop_at - wheel.clock()) * 1000),
+        "latency_ms": round(segment.round_trip * 1000)
+    }
+
+@app.post("/api/segments/stop")
+async def stop_segment(request: SegmentStopRequest):
+    """End the running segment now"""
+    segments.cancel(await spotify_user_id(request.access_token))
+    try:
+        await segments.player.pause(request.access_token, request.device_id)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Pause failed: {str(e)}")
+    return {"stopped": True}
+
+# Zones: one schedule and playlist rotation driving many member accounts.
+# They are stored as the scheduler daemon's zone files, so the daemon picks up every edit and fires them.
+SCHEDULER_STATE_DIR = os.environ.get('SCHEDULER_STATE_DIR', 'scheduler-state')
+ZONE_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+zone_dispatcher = ZoneDispatcher(PlaylistIndexCache(), segments)
+# Serializes read-modify-write of zone files within this process
+zone_files_lock = asyncio.Lock()
+
+class ZoneMemberRequest(BaseModel):
+    access_token: str
+    device_id: Optional[str] = None
+    refresh_token: Optional[str] = None
+    expires_at: Optional[float] = None  # epoch seconds
+
+def zone_path(zone_id):
+    if not ZONE_ID_PATTERN.fullmatch(zone_id):
+        raise HTTPException(status_code=400, detail="Invalid zone id")
+    return os.path.join(SCHEDULER_STATE_DIR, 'zones', f"{zone_id}.json")
+
+def get_zone(zone_id):
+    """(Zone, time zone) from the zone's file"""
+    try:
+        return read_zone_file(zone_path(zone_id), zone_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Zone not found")
+
+@app.put("/api/zones/{zone_id}", dependencies=[Depends(require_admin)])
+async def put_zone(zone_id: str, settings: dict = Body(...), timezone: Optional[str] = None):
+    """Create a zone or replace its schedule and playlist rotation
+
+    Members and resume positions are kept; ``timezone`` is an IANA name the
+    zone's slots follow, kept as it was when left out.
+    """
+    if timezone:
+        try:
+            ZoneInfo(timezone)
+        except (ValueError, ZoneInfoNotFoundError):
+            raise HTTPException(status_code=400, detail=f"Unknown time zone: {timezone}")
+    async with zone_files_lock:
+        path = zone_path(zone_id)
+        try:
+            zone, saved_timezone = read_zone_file(path, zone_id)
+        except FileNotFoundError:
+            zone, saved_timezone = Zone(zone_id, normalize_settings({})), None
+        zone.update_settings(settings)
+        write_zone_file(path, zone, timezone or saved_timezone)
+    return {"zone_id": zone_id, "members": list(zone.members)}
+
+@app.delete("/api/zones/{zone_id}", dependencies=[Depends(require_admin)])
+async def delete_zone(zone_id: str):
+    async with zone_files_lock:
+        try:
+            os.remove(zone_path(zone_id))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Zone not found")
+    return {"deleted": True}
+
+@app.put("/api/zones/{zone_id}/members/{user_id}", dependencies=[Depends(require_admin)])
+async def join_zone(zone_id: str, user_id: str, request: ZoneMemberRequest):
+    """Add an account (or replace its tokens and device) in a zone
+
+    With a refresh token and expiry the daemon keeps the member's access
+    token fresh; without them it plays until the token expires.
+    """
+    async with zone_files_lock:
+        zone, timezone = get_zone(zone_id)
+        zone.add_member(ZoneMember(user_id, request.access_token, request.device_id,
+                                   request.refresh_token, request.expires_at))
+        write_zone_file(zone_path(zone_id), zone, timezone)
+    return {"zone_id": zone_id, "user_id": user_id}
+
+@app.delete("/api/zones/{zone_id}/members/{user_id}", dependencies=[Depends(require_admin)])
+async def leave_zone(zone_id: str, user_id: str):
+    async with zone_files_lock:
+        zone, timezone = get_zone(zone_id)
+        if not zone.remove_member(user_id):
+            raise HTTPException(status_code=404, detail="Member not found")
+        write_zone_file(zone_path(zone_id), zone, timezone)
+    return {"deleted": True}
+
+@app.post("/api/zones/{zone_id}/fire", dependencies=[Depends(require_admin)])
+async def fire_zone(zone_id: str):
+    """Play the zone's current slot on every member now
+
+    Positions advance in the zone file; a running daemon keeps its own
+    positions for the zone, so this is mainly for trying a zone out.
+    """
+    async with zone_files_lock:
+        zone, timezone = get_zone(zone_id)
+        try:
+            results = await zone_dispatcher.fire(zone)
+        except (ValueError, RuntimeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        write_zone_file(zone_path(zone_id), zone, timezone)
+    return {user_id: not isinstance(result, Exception) for user_id, result in results.items()}
+
 # Vercel handler
 handler = Mangum(app)
\ No newline at end of file
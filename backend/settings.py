@@ -0,0 +1,54 @@
+"""Settings blob in the same shape the frontend keeps in localStorage."""
+import copy
+import json
+
+SETTINGS_KEY = 'spotify_timer_settings'
+
+# Defaults applied on load, matching loadLocalSettings in App.js
+DEFAULT_SETTINGS = {
+    'weeklySchedule': {},
+    'calendarSchedule': {},
+    'baseWeeklySchedule': {},
+    'dateOverrides': {},
+    'blockedDates': [],
+    'timerDuration': 30,
+    'playDuration': 30,
+    'playbackTimingMode': 'start',
+    'absoluteTimeMode': False,
+    'absoluteTimeSlots': {'hourly': False, 'halfHourly': False, 'custom': {}},
+    'selectedTracks': [],
+    'selectedPlaylists': [],
+    'scheduledPlaylists': [],
+    'currentPlaylistIndex': 0,
+    'playlistPositions': {},
+    'trackPositions': {},
+    'playlistElapsed': {},
+}
+
+
+def load_settings(raw):
+    """Parse a settings blob, falling back to defaults for missing or empty values"""
+    return normalize_settings(json.loads(raw) if raw else {})
+
+
+def normalize_settings(saved):
+    """Fill defaults into an already-parsed settings dict
+
+    Defaults are copied, since schedulers mutate positions in place.
+    """
+    settings = {key: saved.get(key) or copy.deepcopy(default) for key, default in DEFAULT_SETTINGS.items()}
+    # Blocked dates are a Set in the frontend; keep membership checks O(1) here too
+    settings['blockedDates'] = set(settings['blockedDates'])
+    return settings
+
+
+def settings_to_json(settings):
+    """Settings as plain JSON types, in the localStorage shape"""
+    data = {key: settings.get(key, default) for key, default in DEFAULT_SETTINGS.items()}
+    data['blockedDates'] = sorted(data['blockedDates'])
+    return data
+
+
+def dump_settings(settings):
+    """Serialize settings to the localStorage JSON format"""
+    return json.dumps(settings_to_json(settings), separators=(',', ':'))
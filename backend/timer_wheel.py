@@ -0,0 +1,110 @@
+"""Hashed timer wheel driving scheduled fires and segment stops.
+
+Timers hash into ``slots`` buckets by deadline tick; each tick only the
+current bucket is scanned, so scheduling and cancelling are O(1) however
+many segments are in flight. Deadlines are rounded to the nearest tick,
+keeping the firing error within half a tick either way.
+"""
+import asyncio
+import inspect
+import time
+
+
+class TimerHandle:
+    __slots__ = ('deadline', 'tick', 'callback', 'cancelled')
+
+    def __init__(self, deadline, tick, callback):
+        self.deadline = deadline
+        self.tick = tick
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Single-level hashed wheel with ``tick``-second resolution"""
+
+    def __init__(self, tick=0.005, slots=1024, clock=time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.clock = clock
+        self.buckets = [[] for _ in range(slots)]
+        self.current_tick = int(clock() / tick)
+        self.pending = 0
+        self._wakeup = None
+
+    def schedule(self, deadline, callback):
+        """Run ``callback()`` at monotonic time ``deadline``; coroutines are spawned as tasks"""
+        if not self.pending:
+            # Idle wheels are not advanced; catch up now rather than stepping every idle tick later
+            self.current_tick = max(self.current_tick, int(self.clock() / self.tick))
+        tick = max(round(deadline / self.tick), self.current_tick + 1)
+        handle = TimerHandle(deadline, tick, callback)
+        self.buckets[tick % self.slots].append(handle)
+        self.pending += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return handle
+
+    def call_later(self, delay, callback):
+        return self.schedule(self.clock() + delay, callback)
+
+    def advance(self, now=None):
+        """Run every timer due up to ``now``; returns how many fired"""
+        target = int((self.clock() if now is None else now) / self.tick)
+        fired = 0
+        if self.pending and target - self.current_tick > self.slots:
+            # Long gap: every bucket would be visited anyway, so jump to just before the earliest timer
+            earliest = min(handle.tick for bucket in self.buckets for handle in bucket)
+            self.current_tick = max(self.current_tick, min(earliest, target) - 1)
+        while self.current_tick < target and self.pending:
+            self.current_tick += 1
+            bucket = self.buckets[self.current_tick % self.slots]
+            if not bucket:
+                continue
+            keep = []
+            for handle in bucket:
+                if handle.tick > self.current_tick:
+                    keep.append(handle)
+                    continue
+                self.pending -= 1
+                if not handle.cancelled:
+                    self._run(handle.callback)
+                    fired += 1
+            self.buckets[self.current_tick % self.slots] = keep
+        self.current_tick = max(self.current_tick, target)
+        return fired
+
+    def _run(self, callback):
+        try:
+            result = callback()
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result)
+        except Exception as e:
+            print(f"Timer callback failed: {e}")
+
+    def next_deadline(self):
+        """Earliest pending deadline, scanning at most one revolution"""
+        for offset in range(1, self.slots + 1):
+            tick = self.current_tick + offset
+            for handle in self.buckets[tick % self.slots]:
+                if handle.tick == tick and not handle.cancelled:
+                    return tick * self.tick
+        return None
+
+    async def run(self):
+        """Advance the wheel forever, sleeping until the next timer when idle"""
+        self._wakeup = asyncio.Event()
+        while True:
+            self.advance()
+            self._wakeup.clear()
+            delay = None
+            if self.pending:
+                deadline = self.next_deadline()
+                delay = max(deadline - self.clock(), 0) if deadline is not None else self.slots * self.tick
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,168 @@
+"""Zones: one schedule and playlist rotation shared by many accounts.
+
+A zone resolves its playlist and resume position once per slot, then
+fans the same play request out to every member's device. Each member's
+play call is delayed by the zone start lead minus half its measured
+latency so playback starts together across locations. Upstream calls
+per slot are one snapshot check plus one play call per member.
+
+Zones are kept as ``zones/<zone_id>.json`` files in the scheduler state
+directory: the API edits them and the daemon schedules them.
+"""
+import asyncio
+import json
+import os
+
+from settings import load_settings, normalize_settings, settings_to_json
+
+# Time allowed between resolving a slot and the aligned start of every member
+ZONE_START_LEAD = float(os.environ.get('ZONE_START_LEAD_MS', '250')) / 1000
+# Settings the scheduler advances as slots play, rather than ones an edit sets
+POSITION_KEYS = ('currentPlaylistIndex', 'playlistElapsed', 'playlistPositions')
+
+
+class ZoneMember:
+    __slots__ = ('user_id', 'access_token', 'device_id', 'refresh_token', 'expires_at')
+
+    def __init__(self, user_id, access_token, device_id=None, refresh_token=None, expires_at=None):
+        self.user_id = user_id
+        self.access_token = access_token
+        self.device_id = device_id
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at  # epoch seconds, when known
+
+    @classmethod
+    def from_json(cls, user_id, data):
+        return cls(user_id, data['access_token'], data.get('device_id'),
+                   data.get('refresh_token'), data.get('expires_at'))
+
+    def to_json(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Zone:
+    """Shared settings (schedule, rotation, positions) plus member accounts"""
+
+    def __init__(self, zone_id, settings):
+        self.zone_id = zone_id
+        self.settings = settings
+        self.members = {}
+
+    @classmethod
+    def from_json(cls, zone_id, raw):
+        return cls(zone_id, load_settings(raw))
+
+    def update_settings(self, saved):
+        """Replace the schedule and rotation, keeping members and the positions ``saved`` leaves out"""
+        settings = normalize_settings(saved)
+        for name in POSITION_KEYS:
+            if name not in saved:
+                settings[name] = self.settings.get(name, settings[name])
+        self.settings = settings
+
+    @property
+    def schedule_key(self):
+        """Key for the zone in scheduler and fire-log maps"""
+        return f"zone:{self.zone_id}"
+
+    def add_member(self, member):
+        self.members[member.user_id] = member
+
+    def remove_member(self, user_id):
+        return self.members.pop(user_id, None)
+
+
+def read_zone_file(path, zone_id):
+    """(Zone, IANA time zone or None) from a zones/<zone_id>.json file"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    zone = Zone(zone_id, normalize_settings(data.get('settings') or {}))
+    for member in data.get('members', []):
+        zone.add_member(ZoneMember.from_json(member['user_id'], member))
+    return zone, data.get('timezone')
+
+
+def write_zone_file(path, zone, timezone=None):
+    """Atomically replace a zone file, so the daemon never loads half of one"""
+    data = {
+        'settings': settings_to_json(zone.settings),
+        'members': [member.to_json() for member in zone.members.values()],
+    }
+    if timezone:
+        data['timezone'] = timezone
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+class ZoneDispatcher:
+    """Resolves a zone's slot once and starts segments on every member"""
+
+    def __init__(self, playlists, segments):
+        self.playlists = playlists
+        self.segments = segments
+
+    async def _resolve(self, name, members, playlist_id):
+        """Fetch the index with the first member token that works"""
+        error = None
+        for member in members:
+            try:
+                return await self.playlists.get(playlist_id, member.access_token)
+            except Exception as e:
+                error = e
+        raise RuntimeError(f"Could not resolve playlist for zone {name}: {error}")
+
+    async def _start(self, member, body, duration, start_at):
+        clock = self.segments.wheel.clock
+        latency = self.segments.estimated_latency(member.user_id) or 0
+        await asyncio.sleep(max(start_at - latency / 2 - clock(), 0))
+        return await self.segments.start(member.user_id, member.access_token, body, duration, member.device_id)
+
+    async def play(self, name, members, playlist, elapsed_ms, duration):
+        """Start one segment of ``playlist`` from ``elapsed_ms`` on every member
+
+        Returns the per-member results (an exception for a member that
+        failed) and the playlist's track index. Positions are left to the
+        caller, so the daemon can keep them in its compact store.
+        """
+        index = await self._resolve(name, members, playlist['id'])
+        position, offset_ms = index.locate(elapsed_ms)
+        body = {
+            'context_uri': playlist['uri'],
+            'offset': {'position': position},
+            'position_ms': int(offset_ms),
+        }
+        start_at = self.segments.wheel.clock() + ZONE_START_LEAD
+        results = await asyncio.gather(
+            *(self._start(member, body, duration, start_at) for member in members),
+            return_exceptions=True,
+        )
+        for member, result in zip(members, results):
+            if isinstance(result, Exception):
+                print(f"Zone {name} playback failed for {member.user_id}: {result}")
+        return {member.user_id: result for member, result in zip(members, results)}, index
+
+    async def fire(self, zone):
+        """Play the zone's current slot on all members; returns per-member results"""
+        if not zone.members:
+            return {}
+        settings = zone.settings
+        rotation = settings['scheduledPlaylists']
+        if not rotation:
+            raise ValueError(f"Zone {zone.zone_id} has no scheduled playlists")
+
+        playlist = rotation[settings['currentPlaylistIndex'] % len(rotation)]
+        playlist_key = f"playlist_{playlist['id']}"
+        elapsed_ms = settings['playlistElapsed'].get(playlist_key, 0)
+        duration = settings['playDuration']
+        results, index = await self.play(zone.zone_id, list(zone.members.values()), playlist, elapsed_ms, duration)
+
+        # Shared state advances once per slot, not once per member, and only if anything played
+        if any(not isinstance(result, Exception) for result in results.values()):
+            new_elapsed_ms = elapsed_ms + duration * 1000
+            settings['playlistElapsed'][playlist_key] = new_elapsed_ms
+            settings['playlistPositions'][playlist_key] = index.locate(new_elapsed_ms)[0]
+            settings['currentPlaylistIndex'] += 1
+        return results
@@ -4,6 +4,8 @@ import './App.css';
 // Spotify configuration
 const SPOTIFY_CLIENT_ID = 'b8df048a15f4402a866d7253a435139e';
 const SPOTIFY_REDIRECT_URI = 'https://spotify-timer.vercel.app';
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || '';
+const SEGMENT_FALLBACK_GRACE_MS = 2000; // Tab checks playback stopped this long after the backend's pause
 
 // Timer presets in minutes and seconds for easy testing
 const TIMER_PRESETS = [
@@ -52,6 +54,36 @@ const getFirstDayOfMonth = (year, month) => {
   return new Date(year, month, 1).getDay(); // 0 = Sunday
 };
 
+// Playlist resume helpers
+const DEFAULT_TRACK_DURATION_MS = 210000; // Default 3.5 mins when duration_ms is missing
+
+// Prefix sums over track durations: cumulative[i] is the ms played before track i,
+// cumulative[tracks.length] is the length of the whole playlist
+const buildDurationIndex = (tracks) => {
+  const cumulative = new Float64Array(tracks.length + 1);
+  tracks.forEach((item, i) => {
+    cumulative[i + 1] = cumulative[i] + (item.track.duration_ms || DEFAULT_TRACK_DURATION_MS);
+  });
+  return cumulative;
+};
+
+// Map total ms played in a playlist to the track index and offset within it
+const locateInPlaylist = (cumulative, elapsedMs) => {
+  const total = cumulative[cumulative.length - 1];
+  const position = total > 0 ? ((elapsedMs % total) + total) % total : 0;
+  let lo = 0;
+  let hi = cumulative.length - 2;
+  while (lo < hi) {
+    const mid = (lo + hi + 1) >> 1;
+    if (cumulative[mid] <= position) {
+      lo = mid;
+    } else {
+      hi = mid - 1;
+    }
+  }
+  return { index: lo, offsetMs: position - cumulative[lo] };
+};
+
 const SpotifyTimer = () => {
   // Authentication state
   const [accessToken, setAccessToken] = useState(null);
@@ -77,6 +109,7 @@ const SpotifyTimer = () => {
   const [currentPlaylistIndex, setCurrentPlaylistIndex] = useState(0); // scheduled playlists
   const [trackPositions, setTrackPositions] = useState({}); // remember positions for scheduled
   const [playlistPositions, setPlaylistPositions] = useState({}); // remember playlist positions
+  const [playlistElapsed, setPlaylistElapsed] = useState({}); // total ms played per scheduled playlist
 
   // Enhanced features
   const [activeTab, setActiveTab] = useState('welcome'); // welcome, timer, schedule, tracks, playlists
@@ -110,6 +143,7 @@ const SpotifyTimer = () => {
   const timerIntervalRef = useRef(null);
   const playbackIntervalRef = useRef(null);
   const absoluteTimerRef = useRef(null);
+  const playlistIndexRef = useRef({}); // duration index per playlist, keyed by playlistKey
 
   // Initialize app
   useEffect(() => {
@@ -189,7 +223,7 @@ const SpotifyTimer = () => {
   // Save settings to localStorage whenever they change
   useEffect(() => {
     saveLocalSettings();
-  }, [weeklySchedule, calendarSchedule, timerDuration, playDuration, playbackTimingMode, absoluteTimeMode, absoluteTimeSlots, selectedTracks, selectedPlaylists]);
+  }, [weeklySchedule, calendarSchedule, timerDuration, playDuration, playbackTimingMode, absoluteTimeMode, absoluteTimeSlots, selectedTracks, selectedPlaylists, playlistElapsed]);
 
   const loadLocalSettings = () => {
     try {
@@ -211,6 +245,7 @@ const SpotifyTimer = () => {
         setScheduledPlaylists(settings.scheduledPlaylists || []);
         setPlaylistPositions(settings.playlistPositions || {});
         setTrackPositions(settings.trackPositions || {});
+        setPlaylistElapsed(settings.playlistElapsed || {});
       }
     } catch (error) {
       console.error('Error loading local settings:', error);
@@ -237,7 +272,8 @@ const SpotifyTimer = () => {
         trackPositions,
         scheduledPlaylists,
         playlistPositions,
-        trackPositions
+        trackPositions,
+        playlistElapsed
       };
       localStorage.setItem('spotify_timer_settings', JSON.stringify(settings));
     } catch (error) {
@@ -701,6 +737,53 @@ const SpotifyTimer = () => {
     }
   };
 
+  // Fallback for backends that cannot keep the pause timer (serverless functions, several workers)
+  const pauseIfStillPlaying = async (playback) => {
+    const stateResponse = await fetch('https://api.spotify.com/v1/me/player', {
+      headers: {
+        'Authorization': `Bearer ${accessToken}`
+      }
+    });
+    if (stateResponse.status !== 200) return;
+
+    const state = await stateResponse.json();
+    const playingSegment = playback.context_uri
+      ? state.context?.uri === playback.context_uri
+      : (playback.uris || []).includes(state.item?.uri);
+    if (state.is_playing && playingSegment) {
+      await fetch('https://api.spotify.com/v1/me/player/pause', {
+        method: 'PUT',
+        headers: {
+          'Authorization': `Bearer ${accessToken}`
+        }
+      });
+    }
+  };
+
+  // Segments are started through the backend so they end on time even if this tab is throttled or closed
+  const startSegment = async (playback) => {
+    const response = await fetch(`${BACKEND_URL}/api/segments/start`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({
+        access_token: accessToken,
+        duration: playDuration,
+        ...playback
+      })
+    });
+
+    if (response.ok) {
+      // If the backend's pause never lands, end the segment from here shortly after its stop time
+      const { stop_in_ms: stopInMs } = await response.clone().json();
+      setTimeout(() => {
+        pauseIfStillPlaying(playback).catch(error => console.error('Fallback pause failed:', error));
+      }, stopInMs + SEGMENT_FALLBACK_GRACE_MS);
+    }
+    return response;
+  };
+
   const playCurrentTrack = async () => {
     if (!accessToken) return;
 
@@ -710,17 +793,10 @@ const SpotifyTimer = () => {
     const currentTrack = allTracks[currentTrackIndex % allTracks.length];
     
     try {
-      // Start playback
-      const response = await fetch('https://api.spotify.com/v1/me/player/play', {
-        method: 'PUT',
-        headers: {
-          'Authorization': `Bearer ${accessToken}`,
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-          uris: [currentTrack.uri],
-          position_ms: trackPositions[currentTrack.uri] || 0
-        })
+      // Start playback; the backend pauses it once playDuration is up
+      const response = await startSegment({
+        uris: [currentTrack.uri],
+        position_ms: trackPositions[currentTrack.uri] || 0
       });
 
       if (response.ok) {
@@ -1251,12 +1327,28 @@ const SpotifyTimer = () => {
     }
   };
 
-  const playScheduledPlaylist = async (playlist, playlistKey) => {
-    if (!accessToken) return;
+  const getPlaylistIndex = async (playlist, playlistKey) => {
+    // Only the snapshot is fetched on every slot; tracks are re-read when it changes
+    const snapshotResponse = await fetch(`https://api.spotify.com/v1/playlists/${playlist.id}?fields=snapshot_id`, {
+      headers: {
+        'Authorization': `Bearer ${accessToken}`
+      }
+    });
 
-    try {
-      // Get playlist tracks first
-      const tracksResponse = await fetch(`https://api.spotify.com/v1/playlists/${playlist.id}/tracks`, {
+    if (!snapshotResponse.ok) {
+      throw new Error('Failed to get playlist snapshot');
+    }
+
+    const { snapshot_id: snapshotId } = await snapshotResponse.json();
+    const cached = playlistIndexRef.current[playlistKey];
+    if (cached && cached.snapshotId === snapshotId) {
+      return cached;
+    }
+
+    const tracks = [];
+    let nextUrl = `https://api.spotify.com/v1/playlists/${playlist.id}/tracks?fields=items(track(uri,duration_ms)),next&limit=100`;
+    while (nextUrl) {
+      const tracksResponse = await fetch(nextUrl, {
         headers: {
           'Authorization': `Bearer ${accessToken}`
         }
@@ -1267,59 +1359,57 @@ const SpotifyTimer = () => {
       }
 
       const tracksData = await tracksResponse.json();
-      const tracks = tracksData.items.filter(item => item.track && item.track.uri);
+      tracks.push(...tracksData.items.filter(item => item.track && item.track.uri));
+      nextUrl = tracksData.next;
+    }
 
-      if (tracks.length === 0) {
+    const index = {
+      snapshotId,
+      uris: tracks.map(item => item.track.uri),
+      cumulative: buildDurationIndex(tracks)
+    };
+    playlistIndexRef.current[playlistKey] = index;
+    return index;
+  };
+
+  const playScheduledPlaylist = async (playlist, playlistKey) => {
+    if (!accessToken) return;
+
+    try {
+      const { uris, cumulative } = await getPlaylistIndex(playlist, playlistKey);
+
+      if (uris.length === 0) {
         throw new Error('No playable tracks in playlist');
       }
 
-      // Get current position in playlist (where we left off)
-      const savedPosition = playlistPositions[playlistKey] || 0;
-      const currentTrackInPlaylist = tracks[savedPosition % tracks.length];
-      const trackUri = currentTrackInPlaylist.track.uri;
-
-      // Get position within the track (where we left off in this specific track)
-      const trackPosition = trackPositions[trackUri] || 0;
+      // Get total time played in this playlist (where we left off)
+      let elapsedMs = playlistElapsed[playlistKey];
+      if (elapsedMs === undefined) {
+        // Carry over positions saved before elapsed time was tracked
+        const legacyIndex = (playlistPositions[playlistKey] || 0) % uris.length;
+        elapsedMs = cumulative[legacyIndex] + (trackPositions[uris[legacyIndex]] || 0);
+      }
+      const { index, offsetMs } = locateInPlaylist(cumulative, elapsedMs);
 
-      // Start playback from where we left off
-      const response = await fetch('https://api.spotify.com/v1/me/player/play', {
-        method: 'PUT',
-        headers: {
-          'Authorization': `Bearer ${accessToken}`,
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-          context_uri: playlist.uri,
-          offset: { position: savedPosition % tracks.length },
-          position_ms: trackPosition
-        })
+      // Start playback from where we left off; the backend pauses it once playDuration is up
+      const response = await startSegment({
+        context_uri: playlist.uri,
+        offset: { position: index },
+        position_ms: Math.floor(offsetMs)
       });
 
       if (response.ok) {
         // After playback, update positions for next time
         setTimeout(() => {
-          const newTrackPosition = trackPosition + (playDuration * 1000);
-          const trackDuration = currentTrackInPlaylist.track.duration_ms || 210000; // Default 3.5 mins
-
-          // If we've played past the end of the track, move to next track
-          if (newTrackPosition >= trackDuration) {
-            // Move to next track in playlist
-            setPlaylistPositions(prev => ({
-              ...prev,
-              [playlistKey]: savedPosition + 1
-            }));
-            // Reset track position for new track
-            setTrackPositions(prev => ({
-              ...prev,
-              [trackUri]: 0
-            }));
-          } else {
-            // Update position within current track
-            setTrackPositions(prev => ({
-              ...prev,
-              [trackUri]: newTrackPosition
-            }));
-          }
+          const newElapsedMs = elapsedMs + (playDuration * 1000);
+          setPlaylistElapsed(prev => ({
+            ...prev,
+            [playlistKey]: newElapsedMs
+          }));
+          setPlaylistPositions(prev => ({
+            ...prev,
+            [playlistKey]: locateInPlaylist(cumulative, newElapsedMs).index
+          }));
 
           // Move to next playlist for next scheduled time
           setCurrentPlaylistIndex(prev => prev + 1);
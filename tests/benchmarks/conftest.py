@@ -0,0 +1,109 @@
+"""Microbenchmark harness.
+
+Without ``--bench`` every benchmark runs once as a smoke test. With it,
+each is timed in rounds that alternate a short run of the benchmark with
+a short run of a fixed reference loop. Its cost is the median over the
+rounds of benchmark time / reference time, so a slower or busier machine
+scales both alike and a burst of noise only spoils a round or two.
+``baselines.json`` stores these relative costs, measured over more rounds;
+anything slower than its baseline times ``--bench-threshold`` fails.
+``--bench-update`` rewrites the baselines and ``--bench-json`` writes the
+results for CI.
+"""
+import json
+import platform
+import statistics
+import timeit
+from pathlib import Path
+
+import pytest
+
+BASELINES_PATH = Path(__file__).with_name('baselines.json')
+ROUNDS = 21
+# Baselines are measured once and compared against on every run, so they get more rounds
+BASELINE_ROUNDS = 3 * ROUNDS
+ROUND_SECONDS = 0.02
+
+
+def reference_loop():
+    """Fixed mix of int, str and dict work the benchmarks are measured against"""
+    counts = {}
+    for i in range(200):
+        key = str(i & 15)
+        counts[key] = counts.get(key, 0) + len(key) * i
+    return counts
+
+
+def calls_per_round(timer):
+    """Number of calls that takes about ROUND_SECONDS"""
+    number, elapsed = timer.autorange()
+    return max(1, round(number * ROUND_SECONDS / elapsed))
+
+
+def interleaved_ns_per_call(rounds, fn, *args):
+    """Median ns per call of fn and of the reference loop, and their median ratio, over interleaved rounds"""
+    timer = timeit.Timer(lambda: fn(*args))
+    reference = timeit.Timer(reference_loop)
+    number, reference_number = calls_per_round(timer), calls_per_round(reference)
+    costs, references = [], []
+    for _ in range(rounds):
+        costs.append(timer.timeit(number) / number * 1e9)
+        references.append(reference.timeit(reference_number) / reference_number * 1e9)
+    ratios = [cost / ref for cost, ref in zip(costs, references)]
+    return statistics.median(costs), statistics.median(references), statistics.median(ratios), number
+
+
+@pytest.fixture(scope='session')
+def bench_results(request):
+    results = {}
+    yield results
+
+    config = request.config
+    if not results:
+        return
+    if config.getoption('--bench-update'):
+        baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+        baselines.update({name: result['relative'] for name, result in results.items() if 'relative' in result})
+        BASELINES_PATH.write_text(json.dumps(dict(sorted(baselines.items())), indent=2) + '\n')
+    path = config.getoption('--bench-json')
+    if path:
+        Path(path).write_text(json.dumps({
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'threshold': config.getoption('--bench-threshold'),
+            'results': results,
+        }, indent=2) + '\n')
+
+
+@pytest.fixture
+def bench(request, bench_results):
+    """Call ``bench(fn, *args)``; returns fn's result"""
+    config = request.config
+    name = request.node.name
+
+    def run(fn, *args):
+        result = fn(*args)
+        if not (config.getoption('--bench') or config.getoption('--bench-update')):
+            return result
+
+        rounds = BASELINE_ROUNDS if config.getoption('--bench-update') else ROUNDS
+        ns_per_call, reference_ns, relative, number = interleaved_ns_per_call(rounds, fn, *args)
+
+        baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+        baseline = baselines.get(name)
+        ratio = relative / baseline if baseline else None
+        bench_results[name] = {
+            'ns_per_call': round(ns_per_call, 1),
+            'calls': number,
+            'reference_ns': round(reference_ns, 1),
+            'relative': round(relative, 4),
+            'baseline': baseline,
+            'ratio': round(ratio, 3) if ratio else None,
+        }
+
+        threshold = config.getoption('--bench-threshold')
+        if ratio and ratio > threshold and not config.getoption('--bench-update'):
+            pytest.fail(f"{name}: {relative:.3f} reference loops/call is {ratio:.2f}x the {baseline:.3f} baseline")
+        return result
+
+    return run
@@ -0,0 +1,24 @@
+import json
+
+# Imported directly: a missing server dependency should fail here, not skip the benchmarks
+import server
+
+TOKEN_RESPONSE = json.dumps({
+    'access_token': 'BQD' + 'x' * 200,
+    'token_type': 'Bearer',
+    'scope': server.SCOPES,
+    'expires_in': 3600,
+    'refresh_token': 'AQC' + 'y' * 130,
+})
+
+
+def parse_token_response(body):
+    return server.build_frontend_callback_url(json.loads(body))
+
+
+def test_build_authorize_url(bench):
+    assert bench(server.build_authorize_url).startswith('https://accounts.spotify.com/authorize?client_id=')
+
+
+def test_parse_token_response(bench):
+    assert '&expires_in=3600' in bench(parse_token_response, TOKEN_RESPONSE)
@@ -0,0 +1,69 @@
+import gc
+import random
+import tracemalloc
+
+from compact_state import CompactStore
+from schedule import DAYS, TIME_SLOTS
+from settings import normalize_settings
+
+# Bytes per active user the compact store may use; the daemon's Zone objects come on top
+MEMORY_BUDGET_BYTES_PER_USER = 256
+PLAYLIST_POOL = 500
+TEMPLATES = 2000
+
+
+def realistic_settings(rng, user_index):
+    """Shop-style schedule: a few slots on weekdays, rotations drawn from a shared pool"""
+    slots = rng.sample(TIME_SLOTS, 4)
+    settings = {
+        'baseWeeklySchedule': {day: {'wholeDay': False, 'timeSlots': {slot: True for slot in slots}} for day in DAYS[:5]},
+        'scheduledPlaylists': [
+            {'id': f'pl{p}', 'uri': f'spotify:playlist:{p:022d}'}
+            for p in rng.sample(range(PLAYLIST_POOL), rng.randint(1, 3))
+        ],
+        'playDuration': 30,
+    }
+    if user_index % 20 == 0:
+        settings['blockedDates'] = ['2024-12-25', '2024-12-26']
+    return normalize_settings(settings)
+
+
+def measure(users, build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build(users)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held, (after - before) / users
+
+
+def test_compact_state_bytes_per_user(request, bench_results):
+    users = 1_000_000 if request.config.getoption('--bench') else 20_000
+    rng = random.Random(11)
+    templates = [realistic_settings(rng, i) for i in range(TEMPLATES)]
+
+    def build_compact(count):
+        store = CompactStore()
+        for i in range(count):
+            store.put(f'{i:028d}', templates[i % TEMPLATES])
+        return store
+
+    def build_dicts(count):
+        # Fresh dicts per user, as each user's settings would be loaded separately
+        return {f'{i:028d}': realistic_settings(rng, i) for i in range(count)}
+
+    store, compact_bytes = measure(users, build_compact)
+    _, dict_bytes = measure(min(users, 5_000), build_dicts)
+    print(f"{users} users: compact {compact_bytes:.0f} B/user "
+          f"(nbytes {store.nbytes() / users:.0f}), nested dicts {dict_bytes:.0f} B/user")
+
+    bench_results['test_compact_state_bytes_per_user'] = {
+        'users': users,
+        'bytes_per_user': round(compact_bytes, 1),
+        'dict_bytes_per_user': round(dict_bytes, 1),
+        'budget_bytes_per_user': MEMORY_BUDGET_BYTES_PER_USER,
+    }
+    assert len(store) == users
+    assert compact_bytes < MEMORY_BUDGET_BYTES_PER_USER
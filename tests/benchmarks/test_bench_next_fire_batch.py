@@ -0,0 +1,44 @@
+import random
+import time
+from datetime import datetime
+
+from compact_state import CompactStore
+from next_fire_batch import rebuild_due_heap
+from schedule import next_fire
+from tests.benchmarks.test_bench_compact_state import TEMPLATES, realistic_settings
+
+LOOP_SAMPLE = 20_000
+AFTER = datetime(2024, 5, 3, 16, 10)  # Friday afternoon: most users' next fire is Monday
+
+
+def test_rebuild_due_heap_vs_per_user_loop(request, bench_results):
+    users = 1_000_000 if request.config.getoption('--bench') else 50_000
+    rng = random.Random(13)
+    templates = [realistic_settings(rng, i) for i in range(TEMPLATES)]
+    store = CompactStore()
+    for i in range(users):
+        store.put(f'{i:028d}', templates[i % TEMPLATES])
+
+    start = time.perf_counter()
+    heap = rebuild_due_heap(store, AFTER)
+    batch_seconds = time.perf_counter() - start
+
+    # Per-user loop over the dict settings, timed on a sample and scaled up
+    sample = min(users, LOOP_SAMPLE)
+    start = time.perf_counter()
+    looped = [next_fire(templates[i % TEMPLATES], AFTER) for i in range(sample)]
+    loop_seconds = (time.perf_counter() - start) * users / sample
+
+    print(f"{users} users: batch heap rebuild {batch_seconds:.2f}s, per-user loop ~{loop_seconds:.2f}s "
+          f"({loop_seconds / batch_seconds:.0f}x)")
+    bench_results['test_rebuild_due_heap_vs_per_user_loop'] = {
+        'users': users,
+        'batch_seconds': round(batch_seconds, 3),
+        'loop_seconds_estimated': round(loop_seconds, 3),
+        'speedup': round(loop_seconds / batch_seconds, 1),
+    }
+
+    assert len(heap) == users
+    by_user = dict((user_id, fire_at) for fire_at, user_id in heap)
+    assert [by_user[f'{i:028d}'] for i in range(sample)] == looped
+    assert batch_seconds < loop_seconds
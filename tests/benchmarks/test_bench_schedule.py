@@ -0,0 +1,39 @@
+from datetime import date, datetime, timedelta
+
+from schedule import DAYS, TIME_SLOTS, format_date_key, get_effective_schedule, next_fire
+
+# A busy account: weekday mornings and afternoons, a few overrides and blocked dates
+SETTINGS = {
+    'baseWeeklySchedule': {
+        day: {'wholeDay': False, 'timeSlots': {slot: slot in ('08:00', '12:30', '16:00') for slot in TIME_SLOTS}}
+        for day in DAYS[:5]
+    },
+    'dateOverrides': {
+        format_date_key(date(2024, 5, 1) + timedelta(days=i)): {'wholeDay': True, 'timeSlots': {}}
+        for i in range(0, 60, 7)
+    },
+    'blockedDates': {format_date_key(date(2024, 5, 1) + timedelta(days=i)) for i in range(3, 60, 11)},
+}
+SPARSE_SETTINGS = {
+    'baseWeeklySchedule': {'Sunday': {'wholeDay': False, 'timeSlots': {'17:00': True}}},
+    'blockedDates': set(),
+}
+DATES = [date(2024, 5, 1) + timedelta(days=i) for i in range(60)]
+
+
+def resolve_all(settings, dates):
+    return [get_effective_schedule(settings, day) for day in dates]
+
+
+def test_effective_schedule_resolution(bench):
+    resolved = bench(resolve_all, SETTINGS, DATES)
+    assert resolved[3] == {'blocked': True}
+    assert resolved[0]['override']
+
+
+def test_next_fire_same_day(bench):
+    assert bench(next_fire, SETTINGS, datetime(2024, 5, 2, 9, 0)) == datetime(2024, 5, 2, 12, 30)
+
+
+def test_next_fire_week_ahead(bench):
+    assert bench(next_fire, SPARSE_SETTINGS, datetime(2024, 5, 6, 9, 0)) == datetime(2024, 5, 12, 17, 0)
@@ -0,0 +1,27 @@
+import json
+
+from schedule import DAYS, TIME_SLOTS
+from settings import dump_settings, load_settings
+
+SETTINGS = load_settings(json.dumps({
+    'weeklySchedule': {day: {'wholeDay': False, 'timeSlots': {slot: True for slot in TIME_SLOTS}} for day in DAYS},
+    'playDuration': 45,
+    'scheduledPlaylists': [
+        {'id': f'playlist{i}', 'name': f'Playlist {i}', 'uri': f'spotify:playlist:playlist{i}'} for i in range(10)
+    ],
+    'trackPositions': {f'spotify:track:{i:022d}': i * 1000 for i in range(200)},
+    'playlistElapsed': {f'playlist_playlist{i}': i * 30000 for i in range(10)},
+    'blockedDates': ['2024-12-25', '2024-12-26'],
+}))
+RAW_SETTINGS = dump_settings(SETTINGS)
+
+
+def test_save_settings(bench):
+    assert bench(dump_settings, SETTINGS) == RAW_SETTINGS
+
+
+def test_load_settings(bench):
+    loaded = bench(load_settings, RAW_SETTINGS)
+    assert loaded['playDuration'] == 45
+    assert loaded['blockedDates'] == {'2024-12-25', '2024-12-26'}
+
@@ -0,0 +1,14 @@
+import os
+import sys
+
+# Backend modules are imported flat, the same way server.py runs from backend/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench', action='store_true', help='Time benchmarks and compare them to stored baselines')
+    group.addoption('--bench-update', action='store_true', help='Rewrite stored baselines from this run')
+    group.addoption('--bench-threshold', type=float, default=1.5,
+                    help='Fail when a benchmark is slower than baseline by this factor')
+    group.addoption('--bench-json', default=None, help='Write benchmark results as JSON to this path')
@@ -0,0 +1,89 @@
+import random
+from datetime import date, datetime, timedelta
+
+from compact_state import CompactStore
+from schedule import DAYS, TIME_SLOTS, format_date_key, next_fire
+from settings import normalize_settings
+
+
+def random_settings(rng):
+    week = {
+        day: {'wholeDay': rng.random() < 0.05, 'timeSlots': {slot: rng.random() < 0.1 for slot in TIME_SLOTS}}
+        for day in DAYS if rng.random() < 0.7
+    }
+    days = [date(2024, 5, 1) + timedelta(days=i) for i in range(40)]
+    return normalize_settings({
+        'baseWeeklySchedule': week,
+        'dateOverrides': {
+            format_date_key(day): {'wholeDay': False, 'timeSlots': {rng.choice(TIME_SLOTS): True}}
+            for day in rng.sample(days, rng.randint(0, 3))
+        },
+        'blockedDates': [format_date_key(day) for day in rng.sample(days, rng.randint(0, 3))],
+        'scheduledPlaylists': [{'id': f'p{i}', 'uri': f'spotify:playlist:p{i}'} for i in range(rng.randint(0, 3))],
+    })
+
+
+def test_next_fire_matches_dict_schedule():
+    rng = random.Random(3)
+    store = CompactStore()
+    users = {f'user{i}': random_settings(rng) for i in range(200)}
+    for user_id, settings in users.items():
+        store.put(user_id, settings)
+
+    for _ in range(20):
+        after = datetime(2024, 5, 1) + timedelta(minutes=rng.randrange(40 * 24 * 60), seconds=rng.choice([0, 30]))
+        for user_id, settings in users.items():
+            assert store.next_fire(user_id, after) == next_fire(settings, after), (user_id, after)
+
+
+def test_rotation_positions_and_row_reuse():
+    store = CompactStore()
+    settings = normalize_settings({
+        'playDuration': 45,
+        'scheduledPlaylists': [{'id': 'a', 'uri': 'spotify:playlist:a'}, {'id': 'b', 'uri': 'spotify:playlist:b'}],
+        'playlistElapsed': {'playlist_b': 90000},
+    })
+    store.put('alice', settings)
+    store.put('bob', settings)
+    # Playlist URIs are interned once across users
+    assert len(store.uris.values) == 2
+
+    store.record_play('alice')
+    assert store.current_playlist('alice') == ('spotify:playlist:b', 90000)
+    store.record_play('alice')
+    store.record_play('alice')
+    assert store.current_playlist('alice') == ('spotify:playlist:b', 135000)
+    assert store.current_playlist('bob') == ('spotify:playlist:a', 0)
+
+    row = store.rows['bob']
+    store.remove('bob')
+    assert store.put('carol', normalize_settings({})) == row
+    assert store.current_playlist('carol') is None
+    assert store.next_fire('carol', datetime(2024, 5, 1)) is None
+    assert len(store) == 2
+
+
+def test_rotation_slices_are_reused():
+    store = CompactStore()
+
+    def rotation(count):
+        return normalize_settings({
+            'scheduledPlaylists': [{'id': f'p{i}', 'uri': f'spotify:playlist:p{i}'} for i in range(count)],
+        })
+
+    for count in range(1, 8):
+        store.put('alice', rotation(count))
+    # Grown through capacities 1, 2, 4 and 8
+    assert len(store.elapsed) == 15
+    assert store.current_playlist('alice') == ('spotify:playlist:p0', 0)
+
+    store.remove('alice')
+    store.put('bob', rotation(3))
+    assert len(store.elapsed) == 15
+
+    # Edits and remove/re-add cycles settle instead of growing
+    for _ in range(50):
+        store.put('carol', rotation(7))
+        store.put('carol', rotation(2))
+        store.remove('carol')
+    assert len(store.elapsed) == 15
@@ -0,0 +1,329 @@
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from typer.testing import CliRunner
+
+from daemon import SchedulerDaemon, cli
+from schedule import DAYS
+
+USERS = 40
+SOAK_DAYS = 21
+START = datetime(2024, 5, 6, 6, 0)  # Monday
+
+
+class CountingDispatcher:
+    """Stands in for Spotify: records fires and what each one played"""
+
+    def __init__(self):
+        self.segments = SimpleNamespace(active={})
+        self.fires = []
+        self.played = []
+
+    async def play(self, name, members, playlist, elapsed_ms, duration):
+        self.fires.append(name.split(':', 1)[1])
+        self.played.append((playlist['uri'], elapsed_ms))
+        return {member.user_id: True for member in members}, None
+
+
+def user_file(slots, days=DAYS[:5]):
+    return {
+        'access_token': 'token',
+        'settings': {
+            'baseWeeklySchedule': {day: {'wholeDay': False, 'timeSlots': {slot: True for slot in slots}} for day in days},
+            'scheduledPlaylists': [{'id': 'p', 'uri': 'spotify:playlist:p'}],
+        },
+    }
+
+
+def write_user(state_dir, user_id, data):
+    path = os.path.join(state_dir, 'users', f'{user_id}.json')
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    # Make sure the edit is visible even within one mtime tick
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    os.makedirs(tmp_path / 'users')
+    return str(tmp_path)
+
+
+def test_fires_reloads_and_recovers_exactly_once(state_dir):
+    write_user(state_dir, 'alice', user_file(['08:00', '09:00']))
+
+    async def first_run():
+        daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+        daemon.reload(START)
+        await daemon.recover(START)
+        assert await daemon.run_due(datetime(2024, 5, 6, 8, 0, 5)) == datetime(2024, 5, 6, 9, 0)
+
+        # Schedule edited while running: picked up without a restart
+        write_user(state_dir, 'alice', user_file(['08:30', '09:00']))
+        assert daemon.reload(datetime(2024, 5, 6, 8, 10)) == ['user:alice']
+        assert await daemon.run_due(datetime(2024, 5, 6, 8, 10)) == datetime(2024, 5, 6, 8, 30)
+        await daemon.run_due(datetime(2024, 5, 6, 8, 30))
+        status = daemon.status(datetime(2024, 5, 6, 8, 30))
+        daemon.fire_log.close()
+        return daemon.dispatcher, status
+
+    dispatcher, status = asyncio.run(first_run())
+    assert dispatcher.fires == ['alice', 'alice']
+    # Each slot resumes where the store's elapsed column left the last one
+    assert dispatcher.played == [('spotify:playlist:p', 0), ('spotify:playlist:p', 30000)]
+    assert status['fired'] == 2 and status['next_fire'] == '2024-05-06T09:00:00'
+
+    async def restarted():
+        daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+        daemon.reload(datetime(2024, 5, 6, 8, 31))
+        await daemon.recover(datetime(2024, 5, 6, 8, 31))
+        await daemon.run_due(datetime(2024, 5, 6, 8, 32))
+        return daemon
+
+    daemon = asyncio.run(restarted())
+    # Nothing re-fired after the restart, and the rotation resumed from positions.json
+    assert daemon.dispatcher.fires == []
+    assert daemon.store.positions('user:alice') == (2, [('spotify:playlist:p', 60000)])
+    # Besides its store row, an account only keeps its member record
+    assert [member.access_token for member in daemon.members['user:alice']] == ['token']
+
+
+def test_malformed_file_is_skipped_without_stopping_the_reload(state_dir):
+    write_user(state_dir, 'alice', user_file(['08:00']))
+    bad = user_file(['08:00'])
+    bad['settings']['blockedDates'] = ['12/25/2024']
+    write_user(state_dir, 'bob', bad)
+
+    daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+    assert daemon.reload(START) == ['user:alice']
+    assert set(daemon.members) == {'user:alice'} and 'user:bob' not in daemon.store
+    assert asyncio.run(daemon.run_due(datetime(2024, 5, 6, 8, 0))) == datetime(2024, 5, 7, 8, 0)
+    assert daemon.dispatcher.fires == ['alice']
+
+    # A bad edit keeps the last good schedule instead of half-applying the new one
+    bad['settings']['baseWeeklySchedule'] = user_file(['10:00'])['settings']['baseWeeklySchedule']
+    write_user(state_dir, 'alice', bad)
+    assert daemon.reload(datetime(2024, 5, 6, 9, 0)) == []
+    assert daemon.store.next_fire('user:alice', datetime(2024, 5, 6, 9, 0)) == datetime(2024, 5, 7, 8, 0)
+    daemon.fire_log.close()
+
+
+@pytest.fixture
+def utc_clock(monkeypatch):
+    """Pins this machine's local clock, which the daemon runs on, to UTC"""
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_slots_follow_the_files_time_zone(state_dir, utc_clock):
+    new_york = user_file(['08:00'], DAYS)
+    new_york['timezone'] = 'America/New_York'
+    write_user(state_dir, 'alice', new_york)
+    write_user(state_dir, 'bob', user_file(['08:00'], DAYS))
+    unknown = user_file(['08:00'], DAYS)
+    unknown['timezone'] = 'Mars/Olympus_Mons'
+    write_user(state_dir, 'carol', unknown)
+
+    async def run():
+        daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+        assert sorted(daemon.reload(START)) == ['user:alice', 'user:bob']
+        await daemon.recover(START)
+        # 08:00 in New York is 12:00 UTC in summer time; bob follows the daemon's own clock
+        assert daemon.next_due == {'user:alice': datetime(2024, 5, 6, 12, 0), 'user:bob': datetime(2024, 5, 6, 8, 0)}
+        await daemon.run_due(datetime(2024, 5, 6, 12, 0))
+        daemon.fire_log.close()
+        return daemon
+
+    daemon = asyncio.run(run())
+    assert daemon.dispatcher.fires == ['bob', 'alice']
+    # Once New York is on winter time the same slot is an hour later in UTC
+    assert daemon.store.next_fire('user:alice', datetime(2024, 11, 4)) == datetime(2024, 11, 4, 13, 0)
+
+
+def test_refreshed_tokens_survive_reload_and_restart(state_dir, monkeypatch):
+    data = user_file(['08:00'])
+    data.update(refresh_token='refresh-1', expires_at=time.time() - 10)
+    write_user(state_dir, 'alice', data)
+    monkeypatch.setattr('daemon.refresh_access_token', lambda refresh_token: {
+        'access_token': 'fresh', 'refresh_token': 'refresh-2', 'expires_in': 3600,
+    })
+
+    async def run():
+        daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+        daemon.reload(START)
+        await daemon.recover(START)
+        await daemon.run_due(datetime(2024, 5, 6, 8, 0))
+        # The file is saved again with its old token: the refreshed one is kept
+        write_user(state_dir, 'alice', data)
+        assert daemon.reload(datetime(2024, 5, 6, 8, 1)) == ['user:alice']
+        daemon.fire_log.close()
+        return daemon
+
+    member, = asyncio.run(run()).members['user:alice']
+    assert (member.access_token, member.refresh_token) == ('fresh', 'refresh-2')
+
+    # After a restart tokens.json still wins over the stale file
+    restarted = SchedulerDaemon(state_dir, CountingDispatcher())
+    restarted.reload(datetime(2024, 5, 6, 8, 2))
+    member, = restarted.members['user:alice']
+    assert (member.access_token, member.refresh_token) == ('fresh', 'refresh-2')
+
+    # Until the file carries a token that expires later
+    data.update(access_token='newer', expires_at=time.time() + 7200)
+    write_user(state_dir, 'alice', data)
+    restarted.reload(datetime(2024, 5, 6, 8, 3))
+    member, = restarted.members['user:alice']
+    assert member.access_token == 'newer'
+    assert restarted.refreshed['user:alice'] == set()
+    restarted.fire_log.close()
+
+
+def test_soak_memory_and_cpu_stay_flat(state_dir):
+    for i in range(USERS):
+        write_user(state_dir, f'user{i}', user_file(['07:00', '09:30', '12:00', '15:30'], DAYS))
+
+    async def soak():
+        daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+        daemon.reload(START)
+        await daemon.recover(START)
+        now = START
+        end_of_day = START.replace(hour=23, minute=59)
+        days = []
+        while len(days) < SOAK_DAYS:
+            cpu = time.process_time()
+            while True:
+                daemon.reload(now)
+                next_at = await daemon.run_due(now)
+                if next_at is None or next_at > end_of_day:
+                    break
+                now = next_at
+            daemon.dispatcher.fires.clear()
+            daemon.dispatcher.played.clear()
+            days.append((time.process_time() - cpu, tracemalloc.get_traced_memory()[0]))
+            now = end_of_day + timedelta(minutes=1)
+            end_of_day += timedelta(days=1)
+            if len(days) == 2:
+                tracemalloc.start()
+        tracemalloc.stop()
+        daemon.fire_log.close()
+        return daemon, days
+
+    daemon, days = asyncio.run(soak())
+    assert daemon.fired == USERS * 4 * SOAK_DAYS
+    # Daily compaction keeps about a day of completions plus today's intents and completions
+    assert os.path.getsize(os.path.join(state_dir, 'fires.log')) < USERS * 4 * 3 * 80
+
+    memory = [traced for _, traced in days[3:]]
+    cpu = [seconds for seconds, _ in days[2:]]
+    print(f"traced bytes per day: {memory[0]} -> {memory[-1]}; cpu s/day: {cpu[0]:.3f} -> {cpu[-1]:.3f}")
+    # Per-day state is replaced, not accumulated
+    assert memory[-1] - memory[0] < 64 * 1024
+    assert sum(cpu[-5:]) < 2 * sum(cpu[:5])
+
+
+class SlowDispatcher(CountingDispatcher):
+    """Each fire takes as long as a zone start lead plus its play calls"""
+
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+        self.in_flight = 0
+        self.peak = 0
+
+    async def play(self, *args):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.seconds)
+        self.in_flight -= 1
+        return await super().play(*args)
+
+
+def test_one_slot_fires_concurrently_with_bounded_fan_out(state_dir):
+    for i in range(20):
+        write_user(state_dir, f'user{i}', user_file(['08:00']))
+
+    async def run():
+        daemon = SchedulerDaemon(state_dir, SlowDispatcher(0.1), fire_concurrency=10)
+        daemon.reload(START)
+        await daemon.recover(START)
+        started = time.perf_counter()
+        await daemon.run_due(datetime(2024, 5, 6, 8, 0))
+        elapsed = time.perf_counter() - started
+        daemon.fire_log.close()
+        return daemon, elapsed
+
+    daemon, elapsed = asyncio.run(run())
+    assert daemon.fired == 20
+    assert daemon.dispatcher.peak == 10
+    # Two waves of ten, not twenty fires one after another
+    assert elapsed < 1.0
+
+    # Accounts without saved positions each get their own resume state
+    with open(os.path.join(state_dir, 'positions.json')) as f:
+        positions = json.load(f)
+    assert {key: value['playlistElapsed'] for key, value in positions.items()} == {
+        f'user:user{i}': {'playlist_p': 30000} for i in range(20)
+    }
+
+
+def test_status_uses_the_daemons_poll_interval(state_dir):
+    daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+    daemon.poll_interval = 60
+    data = daemon.status(START)
+    data['updated_at'] -= 30
+    with open(os.path.join(state_dir, 'status.json'), 'w') as f:
+        json.dump(data, f)
+    daemon.fire_log.close()
+
+    result = CliRunner().invoke(cli, ['status', '--state-dir', state_dir])
+    assert result.exit_code == 0, result.output
+    assert 'poll_interval: 60' in result.output
+
+
+class Crash(BaseException):
+    """Simulates the process dying after the play call, before the outcome is logged"""
+
+
+class CrashingDispatcher(CountingDispatcher):
+    async def play(self, *args):
+        await super().play(*args)
+        raise Crash()
+
+
+def test_crash_between_intent_and_done_refires_once(state_dir):
+    write_user(state_dir, 'alice', user_file(['08:00', '09:00']))
+
+    async def crashed_run():
+        daemon = SchedulerDaemon(state_dir, CrashingDispatcher())
+        daemon.reload(START)
+        await daemon.recover(START)
+        try:
+            await daemon.run_due(datetime(2024, 5, 6, 8, 0, 5))
+        finally:
+            daemon.fire_log.close()
+        return daemon
+
+    with pytest.raises(Crash):
+        asyncio.run(crashed_run())
+
+    async def restarted(now):
+        daemon = SchedulerDaemon(state_dir, CountingDispatcher())
+        daemon.reload(now)
+        await daemon.recover(now)
+        await daemon.run_due(now)
+        daemon.fire_log.close()
+        return daemon.dispatcher.fires
+
+    # The orphaned intent is replayed once within the grace period (at least once, see fire_log)
+    assert asyncio.run(restarted(datetime(2024, 5, 6, 8, 1))) == ['alice']
+    assert asyncio.run(restarted(datetime(2024, 5, 6, 8, 2))) == []
@@ -0,0 +1,148 @@
+import os
+import random
+from datetime import datetime
+
+import pytest
+
+from fire_log import CATCHUP_FIRE_ONCE_LATE, CATCHUP_GRACE, CATCHUP_SKIP, FireLog
+from schedule import fires_between
+from tests.test_compact_state import random_settings
+
+# Monday 2024-05-06
+SETTINGS = {
+    'baseWeeklySchedule': {
+        'Monday': {'wholeDay': False, 'timeSlots': {'07:30': True, '08:00': True, '09:00': True}},
+    },
+}
+SCHEDULES = {'user-1': SETTINGS}
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, user_id, fire_at):
+        self.calls.append((user_id, fire_at))
+
+
+def dispatch(log, schedules, now, fire):
+    """Fire due slots the way the daemon does: intents, the fires, then outcomes"""
+    slots = {}
+    for user_id, fire_at in log.due(schedules, now):
+        slots.setdefault(fire_at, []).append(user_id)
+    for fire_at, user_ids in sorted(slots.items()):
+        user_ids = log.begin_slot(user_ids, fire_at)
+        for user_id in user_ids:
+            fire(user_id, fire_at)
+        log.finish_slot({user_id: True for user_id in user_ids}, fire_at)
+    log.mark_checkpoint(now)
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / 'fires.log')
+
+
+def test_dispatch_fires_each_slot_once_across_restarts(log_path):
+    fire = Recorder()
+    log = FireLog(log_path)
+    log.mark_checkpoint(datetime(2024, 5, 6, 7, 0))
+    dispatch(log, SCHEDULES, datetime(2024, 5, 6, 7, 31), fire)
+    log.close()
+
+    # Restarted mid-slot: the same slot must not fire on the next tick
+    log = FireLog(log_path)
+    assert log.recover(SCHEDULES, datetime(2024, 5, 6, 7, 32)) == []
+    dispatch(log, SCHEDULES, datetime(2024, 5, 6, 7, 33), fire)
+    dispatch(log, SCHEDULES, datetime(2024, 5, 6, 8, 0), fire)
+
+    assert fire.calls == [('user-1', datetime(2024, 5, 6, 7, 30)), ('user-1', datetime(2024, 5, 6, 8, 0))]
+
+
+def test_slot_intents_and_outcomes_are_one_write_each(log_path, monkeypatch):
+    users = [f'user{i}' for i in range(50)]
+    log = FireLog(log_path)
+    fire_at = datetime(2024, 5, 6, 7, 30)
+    syncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: syncs.append(fd) or real_fsync(fd))
+
+    assert log.begin_slot(users, fire_at) == users
+    log.finish_slot({user_id: True for user_id in users}, fire_at)
+    assert len(syncs) == 2
+    assert log.begin_slot(users, fire_at) == []
+
+
+def test_torn_trailing_write_is_discarded(log_path):
+    log = FireLog(log_path)
+    log.mark_checkpoint(datetime(2024, 5, 6, 7, 0))
+    log.close()
+    with open(log_path, 'a') as f:
+        f.write('{"op":"done","user":"user-1","slot":"2024-05')
+
+    log = FireLog(log_path)
+    assert not log.is_completed('user-1', datetime(2024, 5, 6, 7, 30))
+    log.mark_checkpoint(datetime(2024, 5, 6, 7, 1))
+    log.close()
+    assert FireLog(log_path).checkpoint == datetime(2024, 5, 6, 7, 1)
+
+
+@pytest.mark.parametrize('policy, now, expected', [
+    (CATCHUP_SKIP, datetime(2024, 5, 6, 9, 2), []),
+    (CATCHUP_FIRE_ONCE_LATE, datetime(2024, 5, 6, 12, 0), [('user-1', datetime(2024, 5, 6, 9, 0))]),
+    (CATCHUP_GRACE, datetime(2024, 5, 6, 9, 2), [('user-1', datetime(2024, 5, 6, 9, 0))]),
+    (CATCHUP_GRACE, datetime(2024, 5, 6, 12, 0), []),
+])
+def test_catchup_policies(log_path, policy, now, expected):
+    log = FireLog(log_path)
+    log.mark_checkpoint(datetime(2024, 5, 6, 7, 0))
+    log.close()
+
+    log = FireLog(log_path)
+    assert log.recover(SCHEDULES, now, policy=policy, grace_seconds=300) == expected
+    # Everything else in the window was recorded as skipped
+    assert log.is_completed('user-1', datetime(2024, 5, 6, 7, 30))
+    assert log.due(SCHEDULES, now) == []
+
+
+def test_compact_keeps_state(log_path):
+    log = FireLog(log_path)
+    log.mark_checkpoint(datetime(2024, 5, 6, 7, 0))
+    dispatch(log, SCHEDULES, datetime(2024, 5, 6, 8, 0), Recorder())
+    log.compact()
+    log.close()
+
+    log = FireLog(log_path)
+    assert log.checkpoint == datetime(2024, 5, 6, 8, 0)
+    assert log.is_completed('user-1', datetime(2024, 5, 6, 8, 0))
+
+
+def test_due_matches_scalar_fires_between(log_path):
+    rng = random.Random(3)
+    schedules = {f'user{i}': random_settings(rng) for i in range(100)}
+    log = FireLog(log_path)
+    log.mark_checkpoint(datetime(2024, 5, 3, 9, 10))
+    now = datetime(2024, 5, 7, 15, 45)
+
+    expected = sorted(
+        (fire_at, user_id) for user_id, settings in schedules.items()
+        for fire_at in fires_between(settings, log.checkpoint, now)
+    )
+    assert sorted((fire_at, user_id) for user_id, fire_at in log.due(schedules, now)) == expected
+
+
+def test_intent_of_removed_user_is_resolved(log_path):
+    log = FireLog(log_path)
+    log.mark_checkpoint(datetime(2024, 5, 6, 7, 0))
+    log.begin('gone', datetime(2024, 5, 6, 7, 30))
+    log.close()
+
+    log = FireLog(log_path)
+    assert log.recover(SCHEDULES, datetime(2024, 5, 6, 7, 31)) == [('user-1', datetime(2024, 5, 6, 7, 30))]
+    assert log.is_completed('gone', datetime(2024, 5, 6, 7, 30))
+    log.mark_checkpoint(datetime(2024, 5, 8, 7, 0))
+    log.compact()
+    log.close()
+
+    log = FireLog(log_path)
+    assert 'gone' not in log.completed and 'gone' not in log.pending
@@ -0,0 +1,112 @@
+import heapq
+import random
+from datetime import date, datetime, timedelta
+
+from compact_state import CompactStore
+from next_fire_batch import fires_between_batch, next_fire_batch, rebuild_due_heap
+from schedule import DAYS, format_date_key
+from settings import normalize_settings
+from tests.test_compact_state import random_settings
+
+
+def make_store(users):
+    store = CompactStore()
+    for user_id, settings in users.items():
+        store.put(user_id, settings)
+    return store
+
+
+def test_batch_matches_scalar_next_fire():
+    rng = random.Random(5)
+    users = {f'user{i}': random_settings(rng) for i in range(300)}
+    # Only an override two weeks out: resolved past the vectorised horizon
+    users['far'] = normalize_settings({'dateOverrides': {'2024-05-20': {'wholeDay': True}}})
+    # A blocked week hides every weekday slot
+    users['blocked'] = normalize_settings({
+        'baseWeeklySchedule': {day: {'wholeDay': True} for day in DAYS},
+        'blockedDates': [format_date_key(date(2024, 5, 1) + timedelta(days=i)) for i in range(9)],
+    })
+    store = make_store(users)
+    store.remove('user7')
+
+    for _ in range(15):
+        after = datetime(2024, 5, 1) + timedelta(minutes=rng.randrange(30 * 24 * 60), seconds=rng.choice([0, 30]))
+        user_ids = list(store.rows)
+        batch = next_fire_batch(store, user_ids, after)
+        assert batch == {user_id: store.next_fire(user_id, after) for user_id in user_ids}, after
+
+    assert next_fire_batch(store, ['far'], datetime(2024, 5, 1))['far'] == datetime(2024, 5, 20, 7, 0)
+    assert next_fire_batch(store, ['blocked'], datetime(2024, 5, 1))['blocked'] == datetime(2024, 5, 10, 7, 0)
+
+
+def test_rebuild_due_heap_is_ordered_and_complete():
+    rng = random.Random(9)
+    users = {f'user{i}': random_settings(rng) for i in range(200)}
+    users['idle'] = normalize_settings({})
+    store = make_store(users)
+    after = datetime(2024, 5, 3, 12, 10)
+
+    heap = rebuild_due_heap(store, after)
+    expected = sorted(
+        (store.next_fire(user_id, after), user_id) for user_id in store.rows if store.next_fire(user_id, after)
+    )
+    assert sorted(heap) == expected
+    assert [entry[0] for entry in heap] == sorted(entry[0] for entry in heap)
+    # Usable directly with heapq
+    assert heapq.heappop(heap)[0] == expected[0][0]
+    assert all(user_id != 'idle' for _, user_id in heap)
+
+
+def test_corrections_are_cached_until_extras_change():
+    store = make_store({
+        'plain': normalize_settings({'baseWeeklySchedule': {'Friday': {'wholeDay': True}}}),
+        'special': normalize_settings({'dateOverrides': {'2024-05-02': {'timeSlots': {'09:00': True}}}}),
+    })
+    after = datetime(2024, 5, 1)
+    assert next_fire_batch(store, ['special'], after)['special'] == datetime(2024, 5, 2, 9, 0)
+    cached = store.corrections
+
+    # Rescheduling and edits to rows without extras reuse the arrays
+    next_fire_batch(store, ['plain'], after)
+    store.put('plain', normalize_settings({'baseWeeklySchedule': {'Thursday': {'wholeDay': True}}}))
+    assert store.corrections is cached
+
+    store.put('special', normalize_settings({'blockedDates': ['2024-05-03']}))
+    assert store.corrections is None
+    batch = next_fire_batch(store, ['plain', 'special'], after)
+    assert batch == {'plain': datetime(2024, 5, 2, 7, 0), 'special': None}
+
+    store.put('plain', normalize_settings({'blockedDates': ['2024-05-02'],
+                                           'baseWeeklySchedule': {'Thursday': {'wholeDay': True}}}))
+    store.remove('special')
+    assert next_fire_batch(store, ['plain'], after)['plain'] == datetime(2024, 5, 9, 7, 0)
+
+
+def test_rows_in_other_time_zones_match_scalar_next_fire():
+    rng = random.Random(11)
+    store = CompactStore()
+    # Kolkata's half-hour offset moves slots off the local half-hour grid
+    timezones = [None, 'America/New_York', 'Asia/Kolkata']
+    for i in range(300):
+        store.put(f'user{i}', random_settings(rng), timezones[i % 3])
+    assert store.timezone('user1').key == 'America/New_York' and store.timezone('user0') is None
+
+    for _ in range(10):
+        after = datetime(2024, 5, 1) + timedelta(minutes=rng.randrange(30 * 24 * 60))
+        user_ids = list(store.rows)
+        expected = {user_id: store.next_fire(user_id, after) for user_id in user_ids}
+        assert next_fire_batch(store, user_ids, after) == expected
+        heap = rebuild_due_heap(store, after)
+        assert [entry[0] for entry in heap] == sorted(entry[0] for entry in heap)
+
+        # Every fire in a window, as repeated next_fire calls would find them
+        end = after + timedelta(hours=30)
+        expected = []
+        for user_id in user_ids:
+            fire_at = store.next_fire(user_id, after)
+            while fire_at and fire_at <= end:
+                expected.append((fire_at, user_id))
+                fire_at = store.next_fire(user_id, fire_at)
+        fires = fires_between_batch(store, after, end)
+        assert sorted((fire_at, user_id) for user_id, fire_at in fires) == sorted(expected)
+        assert [fire_at for _, fire_at in fires] == sorted(fire_at for _, fire_at in fires)
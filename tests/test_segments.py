@@ -0,0 +1,89 @@
+import asyncio
+import random
+import statistics
+
+from segments import SegmentController
+from timer_wheel import TimerWheel
+
+SEGMENTS = 40
+DURATION = 0.3
+
+
+class FakePlayer:
+    """Local player whose requests take a random one-way latency each way"""
+
+    def __init__(self, clock, latency=(0.01, 0.04)):
+        self.clock = clock
+        self.latency = latency
+        self.started = {}
+        self.stopped = {}
+
+    async def _one_way(self):
+        await asyncio.sleep(random.uniform(*self.latency))
+
+    async def play(self, access_token, body, device_id=None):
+        await self._one_way()
+        self.started[access_token] = self.clock()
+        await self._one_way()
+
+    async def pause(self, access_token, device_id=None):
+        await self._one_way()
+        self.stopped[access_token] = self.clock()
+        await self._one_way()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def test_segment_accuracy_against_fake_player():
+    random.seed(7)
+
+    async def run():
+        wheel = TimerWheel(tick=0.002)
+        player = FakePlayer(wheel.clock)
+        controller = SegmentController(player, wheel)
+        ended = asyncio.Queue()
+        runner = asyncio.create_task(wheel.run())
+        await asyncio.gather(*(
+            controller.start(f"user-{i}", f"token-{i}", {}, DURATION, on_end=ended.put_nowait)
+            for i in range(SEGMENTS)
+        ))
+        for _ in range(SEGMENTS):
+            await asyncio.wait_for(ended.get(), 5)
+        runner.cancel()
+        return player
+
+    player = asyncio.run(run())
+    errors_ms = [
+        (player.stopped[token] - player.started[token] - DURATION) * 1000
+        for token in player.started
+    ]
+    overruns = [e for e in errors_ms if e > 0]
+    underruns = [-e for e in errors_ms if e < 0]
+    print(
+        f"segment error ms: mean={statistics.mean(errors_ms):.1f} "
+        f"p50={percentile(errors_ms, 0.5):.1f} p95={percentile(errors_ms, 0.95):.1f} "
+        f"overruns={len(overruns)} (max {max(overruns, default=0):.1f}) "
+        f"underruns={len(underruns)} (max {max(underruns, default=0):.1f})"
+    )
+
+    assert len(errors_ms) == SEGMENTS
+    # Residual error comes from the random split of each round trip, bounded by the latency spread
+    assert max(abs(e) for e in errors_ms) < 60
+    assert abs(statistics.mean(errors_ms)) < 15
+
+
+def test_new_segment_replaces_pending_stop():
+    async def run():
+        wheel = TimerWheel(tick=0.002)
+        player = FakePlayer(wheel.clock, latency=(0, 0))
+        controller = SegmentController(player, wheel)
+        first = await controller.start('user', 'token', {}, 10)
+        second = await controller.start('user', 'token', {}, 10)
+        return first, second, controller
+
+    first, second, controller = asyncio.run(run())
+    assert first.handle.cancelled
+    assert controller.active['user'] is second
@@ -0,0 +1,115 @@
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import server
+from daemon import SchedulerDaemon
+
+
+class FakePlayer:
+    """Player resolving tokens to users without calling Spotify"""
+
+    def __init__(self, owners):
+        self.owners = owners
+        self.lookups = 0
+        self.paused = []
+
+    async def user_id(self, access_token):
+        self.lookups += 1
+        if access_token not in self.owners:
+            raise RuntimeError('Spotify profile lookup failed with status 401')
+        return self.owners[access_token]
+
+    async def play(self, access_token, body, device_id=None):
+        pass
+
+    async def pause(self, access_token, device_id=None):
+        self.paused.append(access_token)
+
+
+def test_segments_are_keyed_by_token_owner(monkeypatch):
+    player = FakePlayer({'alice-token': 'alice', 'mallory-token': 'mallory'})
+    monkeypatch.setattr(server.segments, 'player', player)
+    monkeypatch.setattr(server, 'user_ids', server.OrderedDict())
+    client = TestClient(server.app)
+
+    response = client.post('/api/segments/start', json={'access_token': 'alice-token', 'duration': 30})
+    assert response.status_code == 200
+    assert 'alice' in server.segments.active
+
+    # Another caller can only stop their own segment
+    assert client.post('/api/segments/stop', json={'access_token': 'mallory-token'}).status_code == 200
+    assert 'alice' in server.segments.active
+    assert client.post('/api/segments/stop', json={'access_token': 'unknown'}).status_code == 401
+
+    assert client.post('/api/segments/stop', json={'access_token': 'alice-token'}).status_code == 200
+    assert 'alice' not in server.segments.active
+    # /v1/me is called once per token
+    assert player.lookups == 3
+
+
+def test_zone_membership_requires_admin(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'admin-secret')
+    monkeypatch.setattr(server, 'SCHEDULER_STATE_DIR', str(tmp_path))
+    client = TestClient(server.app)
+    admin = {'X-Admin-Token': 'admin-secret'}
+    assert client.put('/api/zones/shop', json={}, headers=admin).status_code == 200
+    url = '/api/zones/shop/members/alice'
+
+    assert client.put(url, json={'access_token': 'stolen'}).status_code == 403
+    assert client.delete(url).status_code == 403
+    assert server.get_zone('shop')[0].members == {}
+
+    assert client.put(url, json={'access_token': 'alice-token'}, headers=admin).status_code == 200
+    assert client.delete(url, headers=admin).status_code == 200
+
+
+def test_zones_are_saved_as_scheduler_zone_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'admin-secret')
+    monkeypatch.setattr(server, 'SCHEDULER_STATE_DIR', str(tmp_path))
+    client = TestClient(server.app)
+    admin = {'X-Admin-Token': 'admin-secret'}
+    settings = {
+        'baseWeeklySchedule': {'Monday': {'wholeDay': False, 'timeSlots': {'08:00': True}}},
+        'scheduledPlaylists': [{'id': 'p', 'uri': 'spotify:playlist:p'}],
+    }
+
+    response = client.put('/api/zones/shop?timezone=Europe/Berlin', json=settings, headers=admin)
+    assert response.status_code == 200
+    member = {'access_token': 'alice-token', 'refresh_token': 'alice-refresh', 'expires_at': 1_900_000_000}
+    assert client.put('/api/zones/shop/members/alice', json=member, headers=admin).status_code == 200
+    assert client.put('/api/zones/shop?timezone=Mars/Olympus_Mons', json=settings, headers=admin).status_code == 400
+    assert client.put('/api/zones/shop.json', json=settings, headers=admin).status_code == 400
+
+    # Positions advanced since must survive an edit of the schedule
+    zone, timezone = server.get_zone('shop')
+    zone.settings['currentPlaylistIndex'] = 3
+    server.write_zone_file(server.zone_path('shop'), zone, timezone)
+    settings['playDuration'] = 60
+    assert client.put('/api/zones/shop', json=settings, headers=admin).status_code == 200
+
+    zone, timezone = server.get_zone('shop')
+    assert timezone == 'Europe/Berlin'
+    assert zone.settings['currentPlaylistIndex'] == 3 and zone.settings['playDuration'] == 60
+    alice = zone.members['alice']
+    assert (alice.refresh_token, alice.expires_at) == ('alice-refresh', 1_900_000_000)
+
+    # The scheduler daemon loads the same file
+    daemon = SchedulerDaemon(str(tmp_path))
+    assert daemon.reload(datetime(2024, 5, 6, 6, 0)) == ['zone:shop']
+    assert daemon.store.timezone('zone:shop').key == 'Europe/Berlin'
+    assert daemon.store.positions('zone:shop')[0] == 3
+    daemon.fire_log.close()
+
+    assert client.delete('/api/zones/shop', headers=admin).status_code == 200
+    assert client.delete('/api/zones/shop', headers=admin).status_code == 404
+
+
+def test_admin_toggle_enables_sampling(monkeypatch):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'admin-secret')
+    monkeypatch.setattr(server.profiler, 'sample_rate', 0.0)
+    monkeypatch.setattr(server.profiler, 'enabled', False)
+    client = TestClient(server.app)
+
+    response = client.post('/api/admin/profiler?enabled=true', headers={'X-Admin-Token': 'admin-secret'})
+    assert response.json() == {'enabled': True, 'sample_rate': 0.01}
@@ -0,0 +1,69 @@
+import time
+
+from timer_wheel import TimerWheel
+
+
+class FakeClock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_timers_fire_in_their_tick_and_survive_revolutions():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=0.01, slots=8, clock=clock)
+    fired = []
+    wheel.schedule(100.05, lambda: fired.append('near'))
+    wheel.schedule(100.25, lambda: fired.append('after one revolution'))
+    cancelled = wheel.schedule(100.06, lambda: fired.append('cancelled'))
+    cancelled.cancel()
+
+    assert wheel.advance(100.04) == 0
+    assert wheel.advance(100.051) == 1
+    assert fired == ['near']
+    # Only one revolution is scanned; the run loop sleeps a revolution and looks again
+    assert wheel.next_deadline() is None
+    wheel.advance(100.3)
+    assert fired == ['near', 'after one revolution']
+    assert wheel.pending == 0
+
+
+def test_deadline_in_the_past_fires_on_next_tick():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=0.01, clock=clock)
+    fired = []
+    wheel.schedule(50.0, lambda: fired.append(True))
+    wheel.advance(100.011)
+    assert fired == [True]
+
+
+def test_schedule_after_long_idle_does_not_replay_idle_ticks():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=0.005, slots=1024, clock=clock)
+    wheel.schedule(100.01, lambda: None)
+    wheel.advance(100.02)
+
+    # Eight hours idle, then a segment stop a second out
+    clock.now += 8 * 3600
+    fired = []
+    wheel.call_later(1.0, lambda: fired.append(True))
+    assert wheel.current_tick >= int(clock.now / wheel.tick)
+
+    started = time.perf_counter()
+    wheel.advance(clock.now + 1.001)
+    assert fired == [True]
+    assert time.perf_counter() - started < 0.05
+
+
+def test_far_deadline_skips_empty_ticks():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=0.005, slots=64, clock=clock)
+    fired = []
+    wheel.call_later(3600, lambda: fired.append(True))
+
+    started = time.perf_counter()
+    wheel.advance(clock.now + 3600.001)
+    assert fired == [True]
+    assert time.perf_counter() - started < 0.05
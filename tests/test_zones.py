@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import zones
+from playlist_index import PlaylistIndexCache
+from segments import SegmentController
+from settings import DEFAULT_SETTINGS
+from timer_wheel import TimerWheel
+from zones import Zone, ZoneDispatcher, ZoneMember
+
+MEMBERS = 5
+TRACKS = [{'track': {'uri': f'spotify:track:{i}', 'duration_ms': 20000}} for i in range(250)]
+
+
+class FakeSpotify:
+    """Counts upstream calls; each member's device has its own one-way latency"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = []
+        self.started = {}
+        self.snapshot_id = 'snap-1'
+
+    def fetch_json(self, url, access_token):
+        self.calls.append(('GET', url))
+        if 'fields=snapshot_id' in url:
+            return {'snapshot_id': self.snapshot_id}
+        page = int(url.split('offset=')[1]) if 'offset=' in url else 0
+        next_url = f"{url.split('&offset=')[0]}&offset={page + 100}" if page + 100 < len(TRACKS) else None
+        return {'items': TRACKS[page:page + 100], 'next': next_url}
+
+    async def play(self, access_token, body, device_id=None):
+        self.calls.append(('PLAY', access_token))
+        one_way = int(access_token.split('-')[1]) * 0.004
+        await asyncio.sleep(one_way)
+        self.started.setdefault(access_token, []).append((self.clock(), body))
+        await asyncio.sleep(one_way)
+
+    async def pause(self, access_token, device_id=None):
+        pass
+
+
+def make_zone():
+    zone = Zone.from_json('shop', json.dumps({
+        'playDuration': 30,
+        'scheduledPlaylists': [
+            {'id': 'a', 'uri': 'spotify:playlist:a'},
+            {'id': 'b', 'uri': 'spotify:playlist:b'},
+        ],
+    }))
+    for i in range(MEMBERS):
+        zone.add_member(ZoneMember(f"user-{i}", f"token-{i}"))
+    return zone
+
+
+def run_slots(zone, slots, spotify=None):
+    async def run():
+        wheel = TimerWheel()
+        fake = spotify or FakeSpotify(wheel.clock)
+        dispatcher = ZoneDispatcher(PlaylistIndexCache(fake.fetch_json), SegmentController(fake, wheel))
+        per_slot = []
+        for _ in range(slots):
+            before = len(fake.calls)
+            await dispatcher.fire(zone)
+            per_slot.append(fake.calls[before:])
+        return fake, per_slot
+
+    return asyncio.run(run())
+
+
+def test_zone_resolves_once_and_fans_out(monkeypatch):
+    monkeypatch.setattr(zones, 'ZONE_START_LEAD', 0.05)
+    zone = make_zone()
+    fake, per_slot = run_slots(zone, 4)
+
+    # First use of each playlist pages its tracks; after that one snapshot check per slot
+    for calls in per_slot[2:]:
+        assert len(calls) == MEMBERS + 1
+    assert sum(1 for method, _ in per_slot[2] if method == 'PLAY') == MEMBERS
+
+    # Rotation and positions advanced once per slot, shared by all members
+    settings = zone.settings
+    assert settings['currentPlaylistIndex'] == 4
+    assert settings['playlistElapsed'] == {'playlist_a': 60000, 'playlist_b': 60000}
+    bodies = {json.dumps(started[-1][1], sort_keys=True) for started in fake.started.values()}
+    assert bodies == {json.dumps({'context_uri': 'spotify:playlist:b', 'offset': {'position': 1},
+                                  'position_ms': 10000}, sort_keys=True)}
+
+
+def test_snapshot_change_rebuilds_index(monkeypatch):
+    monkeypatch.setattr(zones, 'ZONE_START_LEAD', 0.0)
+    zone = make_zone()
+    zone.settings['scheduledPlaylists'] = zone.settings['scheduledPlaylists'][:1]
+
+    async def run():
+        fake = FakeSpotify(TimerWheel().clock)
+        dispatcher = ZoneDispatcher(PlaylistIndexCache(fake.fetch_json), SegmentController(fake, TimerWheel()))
+        await dispatcher.fire(zone)
+        fake.snapshot_id = 'snap-2'
+        before = len(fake.calls)
+        await dispatcher.fire(zone)
+        return fake.calls[before:]
+
+    calls = asyncio.run(run())
+    # Snapshot check, three track pages, then the member play calls
+    assert len(calls) == 1 + 3 + MEMBERS
+
+
+def test_members_start_together_once_latency_is_known(monkeypatch):
+    monkeypatch.setattr(zones, 'ZONE_START_LEAD', 0.05)
+    fake, _ = run_slots(make_zone(), 3)
+
+    first = [starts[0][0] for starts in fake.started.values()]
+    last = [starts[-1][0] for starts in fake.started.values()]
+    # Device latencies differ by up to 16 ms one way; alignment removes most of it
+    assert max(first) - min(first) > 0.012
+    assert max(last) - min(last) < 0.008
+
+
+def test_zones_keep_independent_positions(monkeypatch):
+    monkeypatch.setattr(zones, 'ZONE_START_LEAD', 0.0)
+    # Neither zone saves positions, so both start from the defaults
+    first, second = make_zone(), make_zone()
+    run_slots(first, 2)
+
+    assert first.settings['playlistElapsed'] == {'playlist_a': 30000, 'playlist_b': 30000}
+    assert second.settings['playlistElapsed'] == {}
+    assert second.settings['currentPlaylistIndex'] == 0
+    assert DEFAULT_SETTINGS['playlistElapsed'] == {} and DEFAULT_SETTINGS['playlistPositions'] == {}
+
+    run_slots(second, 1)
+    assert second.settings['playlistElapsed'] == {'playlist_a': 30000}
+
+
+def test_failed_slot_does_not_advance_rotation(monkeypatch):
+    monkeypatch.setattr(zones, 'ZONE_START_LEAD', 0.0)
+
+    class OfflineSpotify(FakeSpotify):
+        async def play(self, access_token, body, device_id=None):
+            raise RuntimeError('Spotify play failed with status 404')
+
+    zone = make_zone()
+    run_slots(zone, 2, OfflineSpotify(TimerWheel().clock))
+    assert zone.settings['currentPlaylistIndex'] == 0
+    assert zone.settings['playlistElapsed'] == {}